@@ -0,0 +1,297 @@
+"""Headless benchmark of the views in streamlit_app.py.
+
+	python benchmark.py [--repeat N] [--save FILE] [--compare FILE]
+
+Streamlit is replaced by a stub whose widgets return the values of a scenario,
+so every view runs its data preparation and builds its charts exactly as it
+would for a user; each chart is serialized with to_dict() like st.altair_chart
+does (or measured with its datasets inlined, for the specs of spec_cache). For every view the benchmark reports the latency of the first run with
+empty caches (cold) and of repeated runs over its scenarios (warm), the peak
+memory allocated by a cold run and the size of the Vega-Lite specs it sends.
+
+--save writes the results as a baseline, --compare exits with status 1 if any
+view got slower or heavier than the baseline by more than the tolerances.
+--stages also prints how the warm runs of every view split into the stages
+recorded by instrument.py, --memory the memory every dataset takes as parsed
+from its csv and in the compact dtypes the app keeps it in. --scrub steps the
+year sliders one year at a time, with and without prefetch.py computing the
+neighbouring years in the background.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+
+
+class StubStreamlit(types.ModuleType):
+	# stands in for the streamlit module: widgets answer from self.choices (by
+	# label) or fall back to their default, charts are serialized and measured,
+	# everything else does nothing
+
+	def __init__(self):
+		super().__init__('streamlit')
+		self.choices = {}
+		self.payloads = []
+		self.sidebar = self
+
+	def _choose(self, label, options, default):
+		if label not in self.choices:
+			return default
+		choice = self.choices[label]
+		if options is None or isinstance(choice, list) or choice in options:
+			return choice
+		if isinstance(choice, str):
+			# an option the widget does not offer here, like a group without the
+			# health data, leaves the default
+			return default
+		# a year the slider does not offer, take the closest one
+		return min(options, key=lambda option: abs(option - choice))
+
+	def selectbox(self, label, options, index=0, **kwargs):
+		options = list(options)
+		return self._choose(label, options, options[index])
+
+	def radio(self, label, options, index=0, **kwargs):
+		options = list(options)
+		return self._choose(label, options, options[index])
+
+	def select_slider(self, label, options=(), value=None, **kwargs):
+		options = list(options)
+		return self._choose(label, options, options[0] if value is None else value)
+
+	def multiselect(self, label, options, default=None, **kwargs):
+		return self._choose(label, None, list(default or []))
+
+	def checkbox(self, label, value=False, **kwargs):
+		return self._choose(label, None, value)
+
+	def get_option(self, key):
+		return False
+
+	def altair_chart(self, chart, **kwargs):
+		import altair as alt
+		with alt.data_transformers.enable('default', max_rows=None):
+			spec = chart.to_dict()
+		self.payloads.append(len(json.dumps(spec, separators=(',', ':'))))
+
+	def vega_lite_chart(self, spec, **kwargs):
+		# the specs of spec_cache, measured the same way
+		import instrument
+		self.payloads.append(instrument.spec_size(spec))
+
+	def __getattr__(self, name):
+		# title, markdown, write, header, ...
+		return lambda *args, **kwargs: None
+
+
+st = StubStreamlit()
+sys.modules['streamlit'] = st
+
+# the app imports Altair lazily, on the first chart; imported here so the cold
+# run of the first view does not measure it
+import altair  # noqa: E402,F401
+import data_source  # noqa: E402
+import instrument  # noqa: E402
+import memo  # noqa: E402
+import prefetch  # noqa: E402
+import streamlit_app as app  # noqa: E402
+
+# the views are measured without the prefetching of neighbouring years, which
+# would compete with them for the interpreter; see --scrub for its effect
+PREFETCH_STEPS = prefetch.PREFETCH_STEPS
+prefetch.PREFETCH_STEPS = 0
+
+
+COUNTRIES = ['United States', 'Japan', 'Nigeria', 'Brazil', 'India']
+YEARS = [1990, 2005, 2017]
+ECON = ['GDP per capita (current US$)', 'Unemployment, total (% of total labor force)', 'Gini']
+HEALTH = ['Current health expenditure (% of GDP)', 'Current health expenditure per capita (current US$)',
+	'Life expectancy at birth, total (years)']
+
+# view function -> widget choices of every scenario it is run with
+SCENARIOS = {
+	'run_popu_dist': [
+		{'Country': country, 'Year': year, 'View By Gender': True}
+		for country in COUNTRIES for year in YEARS],
+	'run_var_relationship_per_country': [
+		{'Country': country, 'Economy Indicator': econ, 'Health Indicator': health}
+		for country in COUNTRIES for econ in ECON for health in HEALTH],
+	'run_one_var_across_region': [
+		{'Health / Economy Indicator': indicator, 'Year': year}
+		for indicator in ECON + HEALTH for year in YEARS],
+	'run_trend_over_time': [{'': option} for option in ('All', 'Top Ranked', 'Bottom Ranked')] + [
+		{'': 'Top Ranked', 'Rank By': 'GDP per capita (current US$)', 'As of Year': 2005, 'Number of Countries': 10}] + [
+		{'Select Countries to Compare': COUNTRIES[:n], 'Additional Factors': factor}
+		for n in (1, 3, 5) for factor in ECON + HEALTH[:2]] + [
+		{'Compare': 'World', 'Additional Factors': factor} for factor in ECON],
+	'run_relationship_per_year_all_countries': [
+		{'Economics Factor': econ, 'Health Factor': health, 'Year': year}
+		for econ in ECON for health in HEALTH[:2] for year in YEARS],
+}
+# view -> widget choices and the years of its slider stepped through by --scrub
+SCRUBS = {
+	'run_popu_dist': ({'Country': 'Japan', 'View By Gender': True}, list(range(2017, 1999, -1))),
+	'run_one_var_across_region': ({'Health / Economy Indicator': 'GDP per capita (current US$)'}, list(range(2017, 1999, -1))),
+	'run_relationship_per_year_all_countries': ({'Economics Factor': 'GDP per capita (current US$)',
+		'Health Factor': 'Current health expenditure (% of GDP)'}, list(range(2017, 1999, -1))),
+}
+# views that cannot run without a dataset
+REQUIRES = {'run_popu_dist': 'health'}
+
+
+def run_scenario(view, choices):
+	# runs one view with the given widget choices, returns (seconds, payload bytes)
+	st.choices = choices
+	st.payloads = []
+	start = time.perf_counter()
+	getattr(app, view)()
+	return time.perf_counter() - start, sum(st.payloads)
+
+
+def bench_view(view, scenarios, repeat):
+	# cold run first, then every scenario once untimed so each finds its own
+	# caches filled, then every scenario repeat times with warm caches
+	tracemalloc.start()
+	memo.clear()
+	run_scenario(view, scenarios[0])
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	memo.clear()
+	cold, _ = run_scenario(view, scenarios[0])
+	for scenario in scenarios:
+		run_scenario(view, scenario)
+	instrument.clear()
+	warm = []
+	payloads = []
+	for scenario in scenarios:
+		for _ in range(repeat):
+			seconds, payload = run_scenario(view, scenario)
+			warm.append(seconds)
+		payloads.append(payload)
+	warm.sort()
+	return {
+		'scenarios': len(scenarios),
+		'cold_ms': round(cold * 1000, 2),
+		'warm_ms': round(statistics.median(warm) * 1000, 2),
+		'warm_p95_ms': round(warm[int(0.95 * (len(warm) - 1))] * 1000, 2),
+		'peak_memory_kb': round(peak / 1024, 1),
+		'payload_bytes': round(statistics.mean(payloads)),
+		'payload_max_bytes': max(payloads),
+	}
+
+
+def scrub(view, choices, years, pause):
+	# steps the year slider one year at a time from empty caches, pausing between
+	# steps like a user would; returns the median latency of the steps after the first
+	memo.clear()
+	steps = []
+	for year in years:
+		seconds, _ = run_scenario(view, dict(choices, Year=year))
+		steps.append(seconds)
+		time.sleep(pause)
+	return round(statistics.median(steps[1:]) * 1000, 2)
+
+
+def available(view):
+	name = REQUIRES.get(view)
+	if name is None:
+		return True
+	try:
+		data_source.resolve_source(name, remote=False)
+		return True
+	except FileNotFoundError:
+		return False
+
+
+def memory(name):
+	# (rows, bytes as parsed from the csv, bytes in compact dtypes) of a dataset
+	source = data_source.resolve_source(name, remote=False)
+	parsed = data_source.read_csv(source, **data_source.READ_OPTIONS.get(name, {}))
+	compact = data_source.read_dataset(name, remote=False)
+	return len(compact), data_source.memory_report(parsed).loc['total', 'bytes'], data_source.memory_report(compact).loc['total', 'bytes']
+
+
+def compare(results, baseline, time_tolerance, size_tolerance):
+	# returns the regressions of results against baseline, as printable lines
+	regressions = []
+	for view, result in results.items():
+		if view not in baseline:
+			continue
+		for key, value in result.items():
+			if key == 'scenarios':
+				continue
+			tolerance = time_tolerance if key.endswith('_ms') else size_tolerance
+			before = baseline[view][key]
+			if value > before * (1 + tolerance):
+				regressions.append('{} {}: {} -> {} (+{:.0%})'.format(view, key, before, value, value / before - 1 if before else float('inf')))
+	return regressions
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the views of streamlit_app.py headlessly.")
+	parser.add_argument('--repeat', type=int, default=3, help="warm runs of every scenario")
+	parser.add_argument('--views', nargs='*', default=list(SCENARIOS), help="views to run")
+	parser.add_argument('--save', help="write the results to this baseline file")
+	parser.add_argument('--compare', help="fail if the results regress from this baseline file")
+	parser.add_argument('--time-tolerance', type=float, default=0.5, help="allowed relative slowdown")
+	parser.add_argument('--size-tolerance', type=float, default=0.05, help="allowed relative growth of memory and payloads")
+	parser.add_argument('--stages', action='store_true', help="print the mean time of every stage of the warm runs")
+	parser.add_argument('--memory', action='store_true', help="print the memory taken by every bundled dataset")
+	parser.add_argument('--scrub', type=float, metavar='PAUSE',
+		help="step the year sliders with PAUSE seconds between steps, with and without prefetching")
+	args = parser.parse_args(argv)
+
+	if args.memory:
+		print('{:<42}{:>18}{:>18}{:>18}'.format('dataset', 'rows', 'csv_kb', 'compact_kb'))
+		for name in data_source.DATASETS:
+			try:
+				rows, parsed, compact = memory(name)
+			except FileNotFoundError:
+				print('{:<42} skipped, not bundled'.format(name))
+				continue
+			print('{:<42}{:>18}{:>18}{:>18}'.format(name, rows, round(parsed / 1024, 1), round(compact / 1024, 1)))
+
+	if args.scrub is not None:
+		print('{:<42}{:>18}{:>18}'.format('view', 'step_ms', 'prefetched_ms'))
+		for view, (choices, years) in SCRUBS.items():
+			if view not in args.views or not available(view):
+				continue
+			prefetch.PREFETCH_STEPS = 0
+			alone = scrub(view, choices, years, args.scrub)
+			prefetch.PREFETCH_STEPS = PREFETCH_STEPS
+			prefetched = scrub(view, choices, years, args.scrub)
+			prefetch.PREFETCH_STEPS = 0
+			print('{:<42}{:>18}{:>18}'.format(view, alone, prefetched))
+
+	results = {}
+	columns = ['cold_ms', 'warm_ms', 'warm_p95_ms', 'peak_memory_kb', 'payload_bytes', 'payload_max_bytes']
+	print('{:<42}'.format('view') + ''.join('{:>18}'.format(col) for col in columns))
+	for view in args.views:
+		if not available(view):
+			print('{:<42} skipped, dataset {!r} is not bundled'.format(view, REQUIRES[view]))
+			continue
+		results[view] = bench_view(view, SCENARIOS[view], args.repeat)
+		print('{:<42}'.format(view) + ''.join('{:>18}'.format(results[view][col]) for col in columns))
+		if args.stages:
+			metrics = instrument.snapshot()['views'][view]
+			print('{:<42}'.format('') + ''.join('{:>18}'.format('{} {:.2f}'.format(stage, metrics['stages'][stage] / metrics['runs'] * 1000))
+				for stage in instrument.STAGES if stage in metrics['stages']))
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+	if args.compare:
+		with open(args.compare) as f:
+			regressions = compare(results, json.load(f), args.time_tolerance, args.size_tolerance)
+		for line in regressions:
+			print('REGRESSION ' + line)
+		return 1 if regressions else 0
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,329 @@
+"""Rebuilds the country by year tables in data/ from raw World Bank extracts.
+
+	python build_data.py [--raw-dir DIR] [--force] [--world-map FILE] [--year-cutoff YEAR]
+
+Every indicator is read from its World Bank download (API_<code>_DS2_*.csv) in
+the raw directory. An indicator without a download keeps the values of the last
+build, read back from data/merged_data.csv. Parsed indicators are cached as
+snapshots keyed by the sha1 of their source, so only changed downloads are
+parsed again.
+
+data/canonical.csv, the table the app reads, stops at --year-cutoff. By default
+that is the last year with a life expectancy value, the later years of the
+downloads only hold projections of some indicators.
+
+If the raw directory holds world-110m.json (from vega-datasets), it is also cut
+down to the countries in data/countries.csv and written to static/ at every
+simplification level of MAP_LEVELS, for the app to serve instead of fetching
+it from GitHub.
+
+data/regions.csv holds the region and income group of every country, for the
+regional rollups of the app; the bundled one follows the World Bank
+classification of July 2018 (fiscal year 2019, by the incomes of 2017). If the
+raw directory holds a World Bank country metadata file
+(Metadata_Country_API_*_DS2_*.csv, shipped with every indicator download), it is
+rewritten from that file.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import data_source
+
+
+RAW_DIR = os.path.join(data_source.DATA_DIR, 'raw')
+COUNTRIES_FILE = os.path.join(data_source.DATA_DIR, 'countries.csv')
+REGIONS_FILE = os.path.join(data_source.DATA_DIR, data_source.DATASETS['regions'])
+# simplification level -> Douglas-Peucker tolerance in degrees
+MAP_LEVELS = {'full': 0.0, 'medium': 0.2, 'low': 0.8}
+
+KEYS = ['Country Name', 'Country Code', 'Year']
+GEO_COLUMNS = ['id', 'Latitude (average)', 'Longitude (average)']
+# column name -> World Bank indicator code, in the column order of the tables
+INDICATORS = {
+	'Gini': 'SI.POV.GINI',
+	'Current health expenditure (% of GDP)': 'SH.XPD.CHEX.GD.ZS',
+	'Current health expenditure per capita (current US$)': 'SH.XPD.CHEX.PC.CD',
+	'GDP per capita (current US$)': 'NY.GDP.PCAP.CD',
+	'Life expectancy at birth, total (years)': 'SP.DYN.LE00.IN',
+	'Unemployment, total (% of total labor force)': 'SL.UEM.TOTL.ZS',
+}
+# output file -> (rows kept, extra columns, sort order)
+OUTPUTS = {
+	'merged_data.csv': ('all', [], ['Year', 'Country Code']),
+	'merged_data_country_only.csv': ('countries', [], ['Year', 'Country Code']),
+	'merged_data_country_only_with_id.csv': ('with_id', ['id'], ['Country Code', 'Year']),
+	'merged_data_country_only_with_id_lat_lon.csv': ('with_id', GEO_COLUMNS, ['Country Code', 'Year']),
+	'canonical.csv': ('canonical', GEO_COLUMNS, ['Country Code', 'Year']),
+}
+
+
+def file_digest(path):
+	sha = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			sha.update(chunk)
+	return sha.hexdigest()
+
+
+def find_raw_file(raw_dir, code):
+	# the World Bank suffixes downloads with a release number, take the newest
+	matches = sorted(glob.glob(os.path.join(raw_dir, 'API_{}_DS2_*.csv'.format(code))))
+	return matches[-1] if matches else None
+
+
+def find_metadata_file(raw_dir):
+	# every download carries the same country metadata, take the newest one
+	matches = sorted(glob.glob(os.path.join(raw_dir, 'Metadata_Country_API_*_DS2_*.csv')))
+	return matches[-1] if matches else None
+
+
+def read_raw_indicator(path, column):
+	# World Bank downloads have 4 lines of preamble and one column per year
+	raw = pd.read_csv(path, skiprows=4)
+	years = [col for col in raw.columns if col.strip().isdigit()]
+	long_df = raw.melt(id_vars=['Country Name', 'Country Code'], value_vars=years,
+		var_name='Year', value_name=column)
+	long_df['Year'] = long_df['Year'].astype(int)
+	return long_df[KEYS + [column]]
+
+
+def read_previous_indicator(path, column):
+	return data_source.read_csv(path)[KEYS + [column]]
+
+
+def load_indicator(column, code, raw_dir, force=False):
+	# returns the long table of one indicator and whether it had to be parsed again
+	path = find_raw_file(raw_dir, code)
+	reader = read_raw_indicator
+	if path is None:
+		path = os.path.join(data_source.DATA_DIR, 'merged_data.csv')
+		reader = read_previous_indicator
+	name = 'indicator-' + code.replace('.', '_')
+	stamp = [os.path.basename(path), file_digest(path)]
+	if not force:
+		cached = data_source.read_snapshot(name, stamp)
+		if cached is not None:
+			return cached, path, False
+	long_df = reader(path, column)
+	data_source.write_snapshot(name, long_df, stamp)
+	return long_df, path, True
+
+
+def merge_indicators(frames):
+	# one row per country code and year over the union of all sources
+	names = pd.concat([df[['Country Code', 'Country Name']] for df in frames]).drop_duplicates('Country Code')
+	years = pd.concat([df['Year'] for df in frames])
+	grid = pd.MultiIndex.from_product(
+		[sorted(names['Country Code']), range(years.min(), years.max() + 1)],
+		names=['Country Code', 'Year'])
+	merged = pd.DataFrame(index=grid)
+	for df in frames:
+		merged = merged.join(df.drop(columns='Country Name').set_index(['Country Code', 'Year']))
+	merged = merged.reset_index().merge(names, on='Country Code', how='left')
+	return merged[KEYS + [df.columns[-1] for df in frames]]
+
+
+def latest_year(merged):
+	# the last year of life expectancy, every view of the app is about it
+	return merged.loc[merged['Life expectancy at birth, total (years)'].notna(), 'Year'].max().item()
+
+
+def load_countries():
+	# countries (as opposed to regional aggregates) with their ISO numeric id and centroid
+	return pd.read_csv(COUNTRIES_FILE, dtype={'id': str}, keep_default_na=False,
+		na_values={'Latitude (average)': [''], 'Longitude (average)': ['']})
+
+
+def select_output(merged, countries, rows, extra_columns, sort_by, year_cutoff):
+	df = merged
+	if rows != 'all':
+		df = df.merge(countries[['Country Code'] + GEO_COLUMNS], on='Country Code')
+	if rows == 'with_id':
+		df = df[df['id'] != ''].assign(id=lambda d: d['id'].astype(int))
+	if rows == 'canonical':
+		df = df[df['Year'] <= year_cutoff]
+	return df.sort_values(sort_by)[KEYS + list(INDICATORS) + extra_columns]
+
+
+def read_text(path):
+	if not os.path.exists(path):
+		return None
+	with open(path, newline='') as f:
+		return f.read()
+
+
+def write_text(path, text):
+	# only touches the file when its content changes, so unchanged outputs keep
+	# their snapshots and cached urls
+	if text == read_text(path):
+		return False
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, 'w', newline='') as f:
+		f.write(text)
+	return True
+
+
+def write_csv(df, path):
+	# keeps the line endings of the file being replaced
+	old = read_text(path)
+	line_end = '\r\n' if old is not None and '\r\n' in old else '\n'
+	return write_text(path, df.to_csv(index=False, float_format='%.10g', lineterminator=line_end))
+
+
+def segment_distance(points, start, end):
+	# distance of every point to the segment from start to end
+	direction = end - start
+	length = np.hypot(*direction)
+	if length == 0:
+		return np.hypot(*(points - start).T)
+	return np.abs(direction[0] * (points[:, 1] - start[1]) - direction[1] * (points[:, 0] - start[0])) / length
+
+
+def simplify_arc(points, tolerance):
+	# Douglas-Peucker, keeping both ends so arcs shared by two countries still meet.
+	# A closed arc keeps at least four points to stay a valid ring.
+	keep = np.zeros(len(points), dtype=bool)
+	keep[[0, -1]] = True
+	if tolerance <= 0:
+		keep[:] = True
+		return keep
+	stack = [(0, len(points) - 1)]
+	closed = len(points) > 3 and (points[0] == points[-1]).all()
+	while stack:
+		start, end = stack.pop()
+		if end - start < 2:
+			continue
+		dist = segment_distance(points[start + 1:end], points[start], points[end])
+		i = np.argmax(dist)
+		if dist[i] > tolerance or (closed and keep.sum() < 4):
+			keep[start + 1 + i] = True
+			stack += [(start, start + 1 + i), (start + 1 + i, end)]
+	return keep
+
+
+def remap_arcs(arcs, index):
+	# arc references nest in lists by geometry type, ~i refers to arc i reversed
+	if isinstance(arcs, list):
+		return [remap_arcs(arc, index) for arc in arcs]
+	return index[arcs] if arcs >= 0 else ~index[~arcs]
+
+
+def collect_arcs(arcs, used):
+	if isinstance(arcs, list):
+		for arc in arcs:
+			collect_arcs(arc, used)
+	else:
+		used.add(arcs if arcs >= 0 else ~arcs)
+
+
+def prepare_world_map(topology, ids, tolerance):
+	# keeps the countries with a row in the data, with ids zero-padded like the
+	# data's id column, drops the arcs nobody uses and simplifies the rest
+	geometries = []
+	for geometry in topology['objects']['countries']['geometries']:
+		geo_id = str(geometry.get('id', '')).zfill(3)
+		if geo_id in ids:
+			geometries.append(dict(geometry, id=geo_id))
+	used = set()
+	for geometry in geometries:
+		collect_arcs(geometry.get('arcs', []), used)
+	used = sorted(used)
+	index = {old: new for new, old in enumerate(used)}
+	transform = topology.get('transform')
+	scale = np.asarray(transform['scale']) if transform else np.ones(2)
+	translate = np.asarray(transform['translate']) if transform else np.zeros(2)
+	arcs = []
+	for i in used:
+		quantized = np.asarray(topology['arcs'][i], dtype=float)[:, :2]
+		if transform:
+			# quantized topologies store the first position and then deltas
+			quantized = np.cumsum(quantized, axis=0)
+		points = quantized * scale + translate
+		kept = quantized[simplify_arc(points, tolerance)]
+		if transform:
+			kept = np.diff(kept, axis=0, prepend=[[0, 0]])
+		arcs.append(kept.astype(int if transform else float).tolist())
+	for geometry in geometries:
+		if 'arcs' in geometry:
+			geometry['arcs'] = remap_arcs(geometry['arcs'], index)
+	prepared = {
+		'type': 'Topology',
+		'objects': {'countries': {'type': 'GeometryCollection', 'geometries': geometries}},
+		'arcs': arcs,
+	}
+	if transform:
+		prepared['transform'] = transform
+	return prepared
+
+
+def build_regions(path, countries):
+	# region and income group of the countries of our data; the metadata leaves
+	# both empty for the aggregates
+	metadata = pd.read_csv(path).rename(columns={'IncomeGroup': 'Income Group'})
+	df = countries[['Country Code', 'Country Name']].merge(metadata[['Country Code', 'Region', 'Income Group']],
+		on='Country Code', how='left')
+	df = df.sort_values('Country Name')[['Country Name', 'Region', 'Income Group']]
+	changed = write_csv(df, REGIONS_FILE)
+	print('{:<55} {} countries, {} without a region, {}'.format(os.path.relpath(REGIONS_FILE), len(df),
+		df['Region'].isna().sum(), 'written' if changed else 'unchanged'))
+
+
+def build_world_map(path, countries):
+	ids = set(countries.loc[countries['id'] != '', 'id'])
+	with open(path) as f:
+		topology = json.load(f)
+	for level, tolerance in MAP_LEVELS.items():
+		prepared = prepare_world_map(topology, ids, tolerance)
+		out_path = data_source.world_map_file(level)
+		changed = write_text(out_path, json.dumps(prepared, separators=(',', ':')))
+		print('{:<55} {} countries, {} arcs, {}'.format(os.path.relpath(out_path),
+			len(prepared['objects']['countries']['geometries']), len(prepared['arcs']),
+			'written' if changed else 'unchanged'))
+
+
+def build(raw_dir=RAW_DIR, force=False, world_map=None, year_cutoff=None):
+	frames = []
+	for column, code in INDICATORS.items():
+		long_df, path, rebuilt = load_indicator(column, code, raw_dir, force=force)
+		print('{:<55} {} ({})'.format(column, 'parsed' if rebuilt else 'cached', os.path.relpath(path)))
+		frames.append(long_df)
+	merged = merge_indicators(frames)
+	countries = load_countries()
+	if year_cutoff is None:
+		year_cutoff = latest_year(merged)
+	print('{:<55} {}'.format('year cutoff of canonical.csv', year_cutoff))
+	for file_name, (rows, extra_columns, sort_by) in OUTPUTS.items():
+		df = select_output(merged, countries, rows, extra_columns, sort_by, year_cutoff)
+		changed = write_csv(df, os.path.join(data_source.DATA_DIR, file_name))
+		print('{:<55} {} rows, {}'.format(file_name, len(df), 'written' if changed else 'unchanged'))
+	metadata = find_metadata_file(raw_dir)
+	if metadata is not None:
+		build_regions(metadata, countries)
+	else:
+		print('{:<55} no country metadata, {} is kept as it is'.format(os.path.relpath(raw_dir), os.path.relpath(REGIONS_FILE)))
+	world_map = world_map or os.path.join(raw_dir, 'world-110m.json')
+	if os.path.exists(world_map):
+		build_world_map(world_map, countries)
+	else:
+		print('{:<55} not found, the app keeps fetching the map from GitHub'.format(os.path.relpath(world_map)))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Rebuild the tables in data/ from World Bank extracts.")
+	parser.add_argument('--raw-dir', default=RAW_DIR, help="directory holding the API_<code>_DS2_*.csv downloads")
+	parser.add_argument('--force', action='store_true', help="parse every source even if it is unchanged")
+	parser.add_argument('--world-map', help="world-110m.json topology, by default the one in the raw directory")
+	parser.add_argument('--year-cutoff', type=int, help="last year of canonical.csv, by default the last year with life expectancy")
+	args = parser.parse_args(argv)
+	build(raw_dir=args.raw_dir, force=args.force, world_map=args.world_map, year_cutoff=args.year_cutoff)
+
+
+if __name__ == "__main__":
+	sys.exit(main())
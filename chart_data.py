@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+
+# decimals a column is shown with in axes and tooltips; the data sent to the
+# browser is rounded to them as more precision would never be displayed
+DISPLAY_DECIMALS = {
+	'Gini': 1,
+	'Current health expenditure (% of GDP)': 2,
+	'Current health expenditure per capita (current US$)': 2,
+	'GDP per capita (current US$)': 2,
+	'Life expectancy at birth, total (years)': 3,
+	'Unemployment, total (% of total labor force)': 3,
+	'Latitude (average)': 4,
+	'Longitude (average)': 4,
+	'Population': 0,
+	'% of Total Population': 2,
+	'% of Male Population': 2,
+	'% of Female Population': 2,
+}
+DEFAULT_DECIMALS = 3
+
+
+def chart_data(df, columns):
+	# only the columns a chart encodes, with floats rounded to display precision.
+	# Give the result to the top-level chart so every layer shares one dataset.
+	# The compact dtypes of the datasets are widened back: Altair would encode a
+	# category as ordinal, and float32 values print with float32 noise.
+	columns = list(dict.fromkeys(columns))
+	projected = df[columns]
+	widened = {}
+	for col in columns:
+		values = projected[col]
+		if isinstance(values.dtype, pd.CategoricalDtype):
+			widened[col] = values.astype(object)
+		elif isinstance(values.dtype, pd.SparseDtype):
+			widened[col] = values.sparse.to_dense().astype(np.float64)
+		elif values.dtype.kind == 'f' and values.dtype != np.float64:
+			widened[col] = values.astype(np.float64)
+	if widened:
+		projected = projected.assign(**widened)
+	decimals = {col: DISPLAY_DECIMALS.get(col, DEFAULT_DECIMALS)
+		for col in columns if projected[col].dtype.kind == 'f'}
+	return projected.round(decimals)
+
+
+def year_dates(years):
+	# integer years as January 1st, the way the temporal axes expect them
+	return pd.to_datetime(pd.Series(years).astype(str), format='%Y')
+
+
+def simplify_series(y, tolerance):
+	# Douglas-Peucker over one yearly series, measuring vertical distance, so a
+	# dropped year is never off by more than tolerance (in the units of y).
+	# Returns the mask of kept points; NaN gaps are skipped like the line mark does.
+	keep = np.zeros(len(y), dtype=bool)
+	idx = np.flatnonzero(~np.isnan(y))
+	if len(idx) <= 2:
+		keep[idx] = True
+		return keep
+	keep[idx[[0, -1]]] = True
+	stack = [(0, len(idx) - 1)]
+	while stack:
+		start, end = stack.pop()
+		if end - start < 2:
+			continue
+		x0, x1 = idx[start], idx[end]
+		inner = idx[start + 1:end]
+		chord = y[x0] + (y[x1] - y[x0]) * (inner - x0) / (x1 - x0)
+		dist = np.abs(y[inner] - chord)
+		i = np.argmax(dist)
+		if dist[i] > tolerance:
+			keep[inner[i]] = True
+			stack += [(start, start + 1 + i), (start + 1 + i, end)]
+	return keep
+
+
+def simplified_lines(store, column, tolerance):
+	# every country's series of column reduced to the years simplify_series keeps
+	values = store.matrix(column)
+	keep = np.array([simplify_series(row, tolerance) for row in values])
+	country_idx, year_idx = np.nonzero(keep)
+	return pd.DataFrame({
+		'Country Name': store.countries[country_idx],
+		'Year': year_dates(store.years[year_idx]),
+		column: values[country_idx, year_idx],
+	})
+
+
+BAND_QUANTILES = {'q10': 0.1, 'q25': 0.25, 'Median': 0.5, 'q75': 0.75, 'q90': 0.9}
+
+
+def quantile_band(store, column):
+	# quantiles of column across countries for every year with any value
+	values = store.matrix(column)
+	has_values = ~np.isnan(values).all(axis=0)
+	quantiles = np.nanquantile(values[:, has_values], list(BAND_QUANTILES.values()), axis=0)
+	band = pd.DataFrame(dict(zip(BAND_QUANTILES, quantiles)))
+	band.insert(0, 'Year', year_dates(store.years[has_values]))
+	return band
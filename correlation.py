@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+
+# years the health indicator is looked at after the economy indicator
+MAX_LAG = 5
+# a correlation over fewer pairs of values is left out of the strongest ones
+MIN_PAIRS = 8
+# bump when the table changes, its snapshots are keyed by it
+SCHEMA = 1
+# the correlations of a country are over its years, those of a year over the countries
+ACROSS = {'time': 'Country Name', 'countries': 'Year'}
+
+
+def pearson(x, y):
+	# r of x and y along their last axis, over the positions where both have a
+	# value, and the number of those positions; NaN for constant or short series
+	both = ~(np.isnan(x) | np.isnan(y))
+	n = both.sum(axis=-1)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		x = np.where(both, x - np.where(both, x, 0.0).sum(axis=-1, keepdims=True) / n[..., None], 0.0)
+		y = np.where(both, y - np.where(both, y, 0.0).sum(axis=-1, keepdims=True) / n[..., None], 0.0)
+		r = (x * y).sum(axis=-1) / np.sqrt((x * x).sum(axis=-1) * (y * y).sum(axis=-1))
+	return np.where(n >= 3, r, np.nan), n
+
+
+def ranks(x, mask):
+	# average ranks of x along its last axis among the masked positions, NaN elsewhere
+	flat = np.where(mask, x, np.nan).reshape(-1, x.shape[-1])
+	return pd.DataFrame(flat).rank(axis=1).to_numpy().reshape(x.shape)
+
+
+def spearman(x, y):
+	both = ~(np.isnan(x) | np.isnan(y))
+	return pearson(ranks(x, both), ranks(y, both))
+
+
+def lagged_pairs(store, econ_indicators, health_indicators, max_lag):
+	# every (economy indicator, health indicator, lag) and their values as
+	# pair x country x year arrays, the health values moved lag years earlier so
+	# both line up at the year of the economy value
+	keys, xs, ys = [], [], []
+	for econ in econ_indicators:
+		for health in health_indicators:
+			for lag in range(max_lag + 1):
+				x = store.matrix(econ)
+				y = np.full_like(x, np.nan)
+				y[:, :x.shape[1] - lag] = store.matrix(health)[:, lag:]
+				keys.append((econ, health, lag))
+				xs.append(x)
+				ys.append(y)
+	return keys, np.stack(xs), np.stack(ys)
+
+
+def table(store, econ_indicators, health_indicators, across, max_lag=MAX_LAG):
+	# Pearson and Spearman r of every indicator pair and lag, for every country
+	# across its years or for every year across the countries, all computed in
+	# one batch. Sorted by country or year and then by strength, without the
+	# pairs which never overlap.
+	keys, x, y = lagged_pairs(store, econ_indicators, health_indicators, max_lag)
+	if across == 'time':
+		labels = store.countries
+	else:
+		# pair x year x country
+		x, y = x.swapaxes(1, 2), y.swapaxes(1, 2)
+		labels = store.years
+	r, n = pearson(x, y)
+	rho, _ = spearman(x, y)
+	size = len(labels)
+	column = np.tile(labels, len(keys))
+	df = pd.DataFrame({
+		ACROSS[across]: pd.Categorical(column, categories=labels) if across == 'time' else column,
+		'Economy Indicator': np.repeat([econ for econ, _, _ in keys], size),
+		'Health Indicator': np.repeat([health for _, health, _ in keys], size),
+		'Lag (years)': np.repeat([lag for _, _, lag in keys], size).astype(np.int8),
+		'Pearson r': r.ravel(),
+		'Spearman r': rho.ravel(),
+		'Pairs': n.ravel().astype(np.int16),
+	})
+	df = df[df['Pearson r'].notna()]
+	df = df.assign(strength=-df['Pearson r'].abs()).sort_values([ACROSS[across], 'strength'], kind='stable')
+	return df.drop(columns='strength').astype({'Economy Indicator': 'category', 'Health Indicator': 'category'}).reset_index(drop=True)
+
+
+def strongest(df, across, value, n=10, min_pairs=MIN_PAIRS):
+	# the n strongest relationships of one country or year, by the size of Pearson r
+	rows = df[(df[ACROSS[across]] == value).to_numpy() & (df['Pairs'] >= min_pairs).to_numpy()]
+	return rows.head(n)
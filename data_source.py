@@ -0,0 +1,337 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+try:
+	import fcntl
+except ImportError:
+	# Windows: processes may build the same snapshot at once, which is only wasteful
+	fcntl = None
+
+import numpy as np
+import pandas as pd
+
+import chart_data
+
+
+# locations of data
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SNAPSHOT_DIR = os.environ.get('A3_SNAPSHOT_DIR', os.path.join(DATA_DIR, 'snapshot'))
+REMOTE_ROOT = "https://raw.githubusercontent.com/CMU-IDS-2020/a3-05839_a3/master/data/"
+# files served by Streamlit under app/static/, see .streamlit/config.toml
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# dataset name -> csv file bundled in DATA_DIR, the same file under REMOTE_ROOT is
+# only fetched when it is not bundled
+DATASETS = {
+	'health': 'health.csv',
+	# built by build_data.py
+	'canonical': 'canonical.csv',
+	# the World Bank regions and income groups, rewritten by build_data.py from the
+	# country metadata of the downloads
+	'regions': 'regions.csv',
+}
+# extra pd.read_csv arguments per dataset
+READ_OPTIONS = {
+	# zero-padded ISO 3166 numeric codes, as used by the world map
+	'canonical': {'dtype': {'id': str}},
+}
+# datasets are kept in compact dtypes, see compact(); bumping this invalidates
+# the snapshots written with an older schema
+COMPACT_SCHEMA = 1
+# a float column becomes float32 if no value moves by more than this fraction of
+# the last decimal it is displayed with (see chart_data.DISPLAY_DECIMALS)
+FLOAT32_TOLERANCE = 0.1
+# float columns with at least this share of NaN are held as sparse arrays; off
+# unless A3_SPARSE_THRESHOLD is set, as every view then works on sparse columns
+SPARSE_THRESHOLD = float(os.environ['A3_SPARSE_THRESHOLD']) if os.environ.get('A3_SPARSE_THRESHOLD') else None
+
+
+def resolve_source(name, remote=True):
+	# returns the local path of a dataset, or its remote url if it is not bundled
+	# and remote is allowed
+	file_name = DATASETS[name]
+	path = os.path.join(DATA_DIR, file_name)
+	if os.path.exists(path):
+		return path
+	if not remote:
+		raise FileNotFoundError("dataset '{}' is not bundled at {}".format(name, path))
+	return REMOTE_ROOT + file_name
+
+
+def source_stamp(source):
+	# a local file is identified by its size and modification time, a remote one
+	# by its url, so a remote snapshot stays valid until it is deleted
+	if os.path.exists(source):
+		stat = os.stat(source)
+		return [os.path.basename(source), stat.st_size, stat.st_mtime_ns]
+	return [source]
+
+
+def snapshot_path(name, stamp):
+	digest = hashlib.sha1(json.dumps(stamp).encode('utf-8')).hexdigest()[:12]
+	return os.path.join(SNAPSHOT_DIR, '{}-{}'.format(name, digest))
+
+
+def write_snapshot(name, df, stamp):
+	# one .npy file per column plus a meta.json describing the columns, written
+	# to a temporary directory first so readers never see a half written snapshot
+	path = snapshot_path(name, stamp)
+	tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+	os.makedirs(tmp_path, exist_ok=True)
+	columns = []
+	for i, col in enumerate(df.columns):
+		values = df[col]
+		entry = {'name': col, 'file': '{}.npy'.format(i)}
+		if isinstance(values.dtype, pd.CategoricalDtype):
+			# codes, -1 for missing, and the categories as strings
+			entry['categories'] = '{}.categories.npy'.format(i)
+			np.save(os.path.join(tmp_path, entry['categories']), values.cat.categories.to_numpy(dtype=str))
+			values = values.cat.codes
+			entry['kind'] = 'category'
+		elif values.dtype == object:
+			nulls = values.isna().to_numpy()
+			if nulls.any():
+				entry['nulls'] = '{}.nulls.npy'.format(i)
+				np.save(os.path.join(tmp_path, entry['nulls']), nulls)
+			values = values.where(~nulls, '').to_numpy(dtype=str)
+			entry['kind'] = 'str'
+		else:
+			entry['kind'] = 'num'
+		np.save(os.path.join(tmp_path, entry['file']), np.asarray(values))
+		columns.append(entry)
+	with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+		json.dump({'name': name, 'stamp': stamp, 'columns': columns}, f)
+	try:
+		os.rename(tmp_path, path)
+	except OSError:
+		# another process published the same snapshot first
+		shutil.rmtree(tmp_path, ignore_errors=True)
+	prune_snapshots(name, keep=path)
+	return path
+
+
+def prune_snapshots(name, keep):
+	# processes still mapping a removed snapshot keep reading it until they let go
+	if not os.path.isdir(SNAPSHOT_DIR):
+		return
+	for entry in os.listdir(SNAPSHOT_DIR):
+		path = os.path.join(SNAPSHOT_DIR, entry)
+		if entry.startswith(name + '-') and '.tmp-' not in entry and path != keep:
+			if entry.endswith('.lock'):
+				if path != keep + '.lock':
+					os.remove(path)
+			else:
+				shutil.rmtree(path, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def publishing(name, stamp):
+	# held while a process builds the snapshot matching stamp, so processes
+	# starting together build it once and the others wait to map it
+	if fcntl is None:
+		yield
+		return
+	os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+	with open(snapshot_path(name, stamp) + '.lock', 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_snapshot_meta(name, stamp):
+	# the description of the snapshot matching stamp, None if there is none
+	meta_path = os.path.join(snapshot_path(name, stamp), 'meta.json')
+	if not os.path.exists(meta_path):
+		return None
+	with open(meta_path) as f:
+		return json.load(f)
+
+
+def read_snapshot(name, stamp, columns=None):
+	# memory-maps the columns (all by default) of the snapshot matching stamp,
+	# None if there is none
+	path = snapshot_path(name, stamp)
+	meta = read_snapshot_meta(name, stamp)
+	if meta is None:
+		return None
+	entries = meta['columns']
+	if columns is not None:
+		by_name = {entry['name']: entry for entry in entries}
+		entries = [by_name[col] for col in columns]
+	data = {}
+	for entry in entries:
+		values = np.load(os.path.join(path, entry['file']), mmap_mode='r').view(np.ndarray)
+		if entry['kind'] == 'str':
+			values = values.astype(object)
+			if 'nulls' in entry:
+				values[np.load(os.path.join(path, entry['nulls']))] = np.nan
+		elif entry['kind'] == 'category':
+			categories = np.load(os.path.join(path, entry['categories'])).astype(object)
+			values = pd.Categorical.from_codes(values, categories)
+		data[entry['name']] = values
+	return pd.DataFrame(data, columns=[entry['name'] for entry in entries], copy=False)
+
+
+def read_latest_snapshot(name):
+	# the newest snapshot of name whatever its stamp, None if there is none; for
+	# rebuilds which can reuse parts of the previous result
+	if not os.path.isdir(SNAPSHOT_DIR):
+		return None
+	found = []
+	for entry in os.listdir(SNAPSHOT_DIR):
+		meta_path = os.path.join(SNAPSHOT_DIR, entry, 'meta.json')
+		if entry.startswith(name + '-') and '.tmp-' not in entry and os.path.exists(meta_path):
+			found.append((os.stat(meta_path).st_mtime_ns, meta_path))
+	for _, meta_path in sorted(found, reverse=True):
+		with open(meta_path) as f:
+			meta = json.load(f)
+		if meta.get('name') == name:
+			return read_snapshot(name, meta['stamp'])
+	return None
+
+
+def dataset_stamp(source):
+	return source_stamp(source) + ['compact-{}'.format(COMPACT_SCHEMA)]
+
+
+def dataset_version(name, remote=True):
+	# changes whenever the bundled file changes, names the snapshot directory too
+	source = resolve_source(name, remote=remote)
+	return os.path.basename(snapshot_path(name, dataset_stamp(source)))
+
+
+def world_map_file(level):
+	# world map topology prepared by build_data.py at one simplification level
+	return os.path.join(STATIC_DIR, 'world-110m-{}.json'.format(level))
+
+
+def read_csv(source, **options):
+	return pd.read_csv(source, header=0, skipinitialspace=True, **options)
+
+
+def float32_loss(values, column):
+	# the largest change float32 makes to a value, in units of the last displayed decimal
+	decimals = chart_data.DISPLAY_DECIMALS.get(column, chart_data.DEFAULT_DECIMALS)
+	error = np.abs(values.astype(np.float32).astype(np.float64) - values)
+	return np.nanmax(error) * 10 ** decimals if np.isfinite(error).any() else 0.0
+
+
+def compact(df):
+	# the frame in compact dtypes: strings as categories (ids included, they must
+	# stay zero-padded strings for the world map), integers in the smallest type
+	# holding them and floats as float32 where that is invisible once displayed
+	columns = {}
+	for col in df.columns:
+		values = df[col]
+		if values.dtype == object:
+			values = values.astype('category')
+		elif values.dtype.kind in 'iu':
+			values = pd.to_numeric(values, downcast='integer')
+		elif values.dtype == np.float64 and float32_loss(values.to_numpy(), col) <= FLOAT32_TOLERANCE:
+			values = values.astype(np.float32)
+		if SPARSE_THRESHOLD is not None and values.dtype.kind == 'f' and values.isna().mean() >= SPARSE_THRESHOLD:
+			values = values.astype(pd.SparseDtype(values.dtype, np.nan))
+		columns[col] = values
+	return pd.DataFrame(columns, columns=df.columns)
+
+
+def memory_report(df):
+	# bytes held by every column of a frame, strings included, with a total row
+	report = pd.DataFrame({'dtype': df.dtypes.astype(str), 'bytes': df.memory_usage(index=False, deep=True)})
+	report.loc['total'] = ['', report['bytes'].sum()]
+	return report
+
+
+def read_dataset(name, remote=True, columns=None, stamp=None):
+	# loads a dataset (or some of its columns) in compact dtypes from its snapshot,
+	# converting the whole csv into one on first use. With stamp the columns come
+	# from that version of the file only, even if it changed since.
+	source = resolve_source(name, remote=remote)
+	current = dataset_stamp(source)
+	stamp = stamp or current
+	df = read_snapshot(name, stamp, columns=columns)
+	if df is None:
+		if stamp != current:
+			raise FileNotFoundError("dataset '{}' changed and the snapshot of {} is gone".format(
+				name, os.path.basename(snapshot_path(name, stamp))))
+		df = shared_frame(name, stamp, lambda: compact(read_csv(source, **READ_OPTIONS.get(name, {}))), columns=columns)
+	if SPARSE_THRESHOLD is not None:
+		# snapshots hold dense columns
+		df = compact(df)
+	return df
+
+
+def shared_frame(name, stamp, build, columns=None):
+	# the frame build() returns (or some of its columns), written as the snapshot
+	# of name matching stamp by the first process asking for it and then
+	# memory-mapped by every process, which so share one copy in the page cache
+	built = None
+	try:
+		with publishing(name, stamp):
+			df = read_snapshot(name, stamp, columns=columns)
+			if df is None:
+				built = build()
+				write_snapshot(name, built, stamp)
+				df = read_snapshot(name, stamp, columns=columns)
+			return df
+	except OSError:
+		# a read-only checkout still works, every process holds its own copy
+		if built is None:
+			built = build()
+		return built if columns is None else built[list(columns)]
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def refreshed(names, remote=True):
+	# whether any of the datasets changed on disk since the last call
+	versions = {name: dataset_version(name, remote=remote) for name in names}
+	with _versions_lock:
+		changed = bool(_versions) and versions != _versions
+		_versions.update(versions)
+	return changed
+
+
+def dataset_columns(name, remote=True, stamp=None):
+	# column names of a dataset (of the version stamp names), without loading any of them
+	source = resolve_source(name, remote=remote)
+	meta = read_snapshot_meta(name, stamp or dataset_stamp(source))
+	if meta is not None:
+		return [entry['name'] for entry in meta['columns']]
+	return list(read_csv(source, nrows=0).columns)
+
+
+class Dataset:
+	# the columns of one dataset, each read on first use and then shared by every
+	# frame built from the dataset, so views only load the columns they declare
+	# and two views needing the same column hold it once. All of them come from
+	# the version of the file there was when the dataset was created.
+
+	def __init__(self, name, remote=True):
+		self.name = name
+		self.remote = remote
+		self.stamp = dataset_stamp(resolve_source(name, remote=remote))
+		self.version = os.path.basename(snapshot_path(name, self.stamp))
+		self.column_names = dataset_columns(name, remote=remote, stamp=self.stamp)
+		self._columns = {}
+		self._lock = threading.Lock()
+
+	def frame(self, columns):
+		columns = list(columns)
+		with self._lock:
+			missing = [col for col in columns if col not in self._columns]
+			if missing:
+				# the missing columns are read together, the csv is parsed at most once
+				df = read_dataset(self.name, remote=self.remote, columns=missing, stamp=self.stamp)
+				for col in missing:
+					self._columns[col] = df[col]
+		# not copied, the columns of a snapshot stay memory-mapped
+		return pd.DataFrame({col: self._columns[col] for col in columns}, columns=columns, copy=False)
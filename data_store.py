@@ -0,0 +1,354 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+
+def column_arrays(df):
+	# views of the numpy arrays behind the columns of df, made afresh (iloc) and
+	# as cached by df[col]; extension columns like categories are left out
+	found = []
+	for j, col in enumerate(df.columns):
+		if isinstance(df.dtypes.iloc[j], np.dtype):
+			found.append(df.iloc[:, j].to_numpy())
+			if df.columns.is_unique:
+				found.append(df[col].to_numpy())
+	return found
+
+
+def freeze(df):
+	# marks the arrays behind a frame read-only, the frame is shared by every
+	# session and an accidental in-place write should fail instead of leaking.
+	# The columns are views, marking them and the arrays they view is enough
+	# unless the frame holds a view itself (as assign() leaves it): a fresh view
+	# of its column stays writeable then, and the frame is copied once so it
+	# owns its arrays. Memory-mapped frames are read-only already and kept.
+	for _ in range(2):
+		for values in column_arrays(df):
+			while isinstance(values, np.ndarray):
+				values.flags.writeable = False
+				values = values.base
+		if not any(values.flags.writeable for values in column_arrays(df)):
+			break
+		df = df.copy()
+	return df
+
+
+class DataStore:
+	# country x year index over a frame with 'Country Name' and 'Year' columns.
+	# Rows are sorted by country (in order of first appearance) then year, so the
+	# rows of a country are one contiguous slice, and a dense country x year array
+	# of row positions answers any (country, year) lookup with a single take.
+
+	def __init__(self, df, version=None):
+		# version identifies the data the store was built from, memo keys use it
+		self.version = version
+		codes, names = pd.factorize(df['Country Name'])
+		years = np.sort(df['Year'].unique())
+		year_codes = np.searchsorted(years, df['Year'].to_numpy())
+		order = np.lexsort((year_codes, codes))
+		if (order == np.arange(len(order))).all() and df.index.equals(pd.RangeIndex(len(df))):
+			# already in order, like the frames the app shares between processes;
+			# kept as it is, a copy would lose the memory mapping
+			self.df = freeze(df)
+		else:
+			self.df = freeze(df.iloc[order].reset_index(drop=True))
+		self.countries = np.asarray(names)
+		self.years = years
+		self.country_codes = codes[order]
+		self.year_codes = year_codes[order]
+		self._country_index = {name: i for i, name in enumerate(self.countries)}
+		# rows of country i are self.df.iloc[self._starts[i]:self._starts[i + 1]]
+		self._starts = np.searchsorted(self.country_codes, np.arange(len(self.countries) + 1))
+		# row position of every (country, year), -1 where the frame has no row
+		self.rows = np.full((len(self.countries), len(self.years)), -1, dtype=np.int64)
+		self.rows[self.country_codes, self.year_codes] = np.arange(len(self.df))
+		self._matrices = {}
+
+	@functools.cached_property
+	def dated(self):
+		# the same rows with 'Year' as a datetime, for the temporal axes of the charts;
+		# converted once instead of on every rerun
+		return freeze(self.df.assign(Year=pd.to_datetime(self.df['Year'], format='%Y')))
+
+	def frame(self, dated=False):
+		return self.dated if dated else self.df
+
+	def country_code(self, country):
+		return self._country_index[country]
+
+	def year_code(self, year):
+		# None if the frame has no row for that year
+		j = np.searchsorted(self.years, year)
+		if j < len(self.years) and self.years[j] == year:
+			return j
+		return None
+
+	def country_years(self, country):
+		# sorted years for which the country has a row
+		return self.years[self.rows[self.country_code(country)] >= 0]
+
+	def matrix(self, column):
+		# a column as a dense country x year array, NaN where there is no row;
+		# built on first use and shared afterwards
+		if column not in self._matrices:
+			values = np.full(self.rows.shape, np.nan)
+			present = self.rows >= 0
+			values[present] = self.df[column].to_numpy(dtype=float)[self.rows[present]]
+			values.flags.writeable = False
+			self._matrices[column] = values
+		return self._matrices[column]
+
+	# the lookups below return read-only slices of the shared frame, or of the
+	# dated one if dated is set
+
+	def country(self, country, dated=False):
+		# all rows of one country, in year order
+		i = self.country_code(country)
+		return self.frame(dated).iloc[self._starts[i]:self._starts[i + 1]]
+
+	def year(self, year, dated=False):
+		# all rows of one year, in country order
+		j = self.year_code(year)
+		if j is None:
+			return self.frame(dated).iloc[:0]
+		rows = self.rows[:, j]
+		return self.frame(dated).take(rows[rows >= 0])
+
+	def select_countries(self, countries, dated=False):
+		# rows of the given countries, in the order the countries are given
+		slices = [np.arange(self._starts[i], self._starts[i + 1])
+			for i in (self._country_index[c] for c in countries if c in self._country_index)]
+		if not slices:
+			return self.frame(dated).iloc[:0]
+		return self.frame(dated).take(np.concatenate(slices))
+
+
+AGE_RANGES = ['0-14', '15-19', '20-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69', '70-74', '75-79', '80 and above']
+SEXES = ['total', 'male', 'female']
+# ages the buckets start at, and where the last one is taken to end
+AGE_BOUNDS = np.array([0, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 100])
+# buckets 0-14, 15-64 and 65 and above of the dependency ratios
+YOUNG, WORKING, OLD = slice(0, 1), slice(1, 11), slice(11, None)
+# indicators age_summary() derives from the age shares, named like their World
+# Bank counterparts
+AGE_INDICATORS = ['Median age (years)', 'Age dependency ratio (% of working-age population)',
+	'Age dependency ratio, young (% of working-age population)', 'Age dependency ratio, old (% of working-age population)',
+	'Population ages 65 and above (% of total population)']
+
+
+def age_share_column(age_range, sex):
+	if sex == 'total':
+		return 'Population ages {} (% of total population)'.format(age_range)
+	return 'Population ages {}, {} (% of {} population)'.format(age_range, sex, sex)
+
+
+def median_ages(shares):
+	# for rows of age bucket shares: the bucket holding the median, -1 if the
+	# shares have gaps before reaching it, and the median age interpolated within
+	# that bucket, NaN if a share of the row is missing
+	cumulative = np.cumsum(shares, axis=1)
+	half = np.nansum(shares, axis=1) / 2.0
+	with np.errstate(invalid='ignore'):
+		hits = cumulative >= half[:, None]
+	bucket = hits.argmax(axis=1)
+	buckets = np.where(hits.any(axis=1), bucket, -1)
+	rows = np.arange(len(shares))
+	below = np.where(bucket > 0, cumulative[rows, bucket - 1], 0.0)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		ages = AGE_BOUNDS[bucket] + (half - below) / shares[rows, bucket] * (AGE_BOUNDS[bucket + 1] - AGE_BOUNDS[bucket])
+	return buckets, np.where(np.isnan(shares).any(axis=1) | (buckets < 0), np.nan, ages)
+
+
+def age_summary(df):
+	# AGE_INDICATORS of every row of a frame with the total population shares,
+	# with its 'Country Name' and 'Year'; the ratios are per 100 people aged 15-64
+	# in single precision like the compacted datasets, the shares have fewer digits anyway
+	shares = df[[age_share_column(age_range, 'total') for age_range in AGE_RANGES]].to_numpy(dtype=np.float32)
+	young = shares[:, YOUNG].sum(axis=1)
+	working = shares[:, WORKING].sum(axis=1)
+	old = shares[:, OLD].sum(axis=1)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		values = [median_ages(shares)[1], (young + old) / working * 100.0, young / working * 100.0,
+			old / working * 100.0, old / shares.sum(axis=1) * 100.0]
+	return df[['Country Name', 'Year']].assign(**{indicator: value.astype(np.float32) for indicator, value in zip(AGE_INDICATORS, values)})
+
+
+class AgeTable:
+	# population share and head count of every age bucket for every row of a
+	# DataStore over the health data, as dense (row, sex, age bucket) arrays.
+	# The health data has no 0-14 bucket by sex, those cells are NaN.
+
+	def __init__(self, store):
+		self.store = store
+		# the data it was built from, memo keys use it like a store's
+		self.version = store.version
+		df = store.df
+		self.shares = np.full((len(df), len(SEXES), len(AGE_RANGES)), np.nan)
+		population = np.full((len(df), len(SEXES)), np.nan)
+		for s, sex in enumerate(SEXES):
+			for a, age_range in enumerate(AGE_RANGES):
+				col = age_share_column(age_range, sex)
+				if col in df.columns:
+					self.shares[:, s, a] = df[col].to_numpy(dtype=float)
+			col = 'Population, {}'.format(sex)
+			if col in df.columns:
+				population[:, s] = df[col].to_numpy(dtype=float)
+		self.counts = self.shares / 100.0 * population[:, :, None]
+		# largest share of any bucket in the whole table, fixes the y range of the histogram
+		self.share_max = np.nanmax(self.shares) if np.isfinite(self.shares).any() else 0.0
+		self.median_buckets, _ = median_ages(self.shares[:, 0])
+
+	def position(self, country, year):
+		j = self.store.year_code(year)
+		if j is None:
+			return -1
+		return self.store.rows[self.store.country_code(country), j]
+
+	def sample_years(self, country, count=5):
+		# up to count years of the country, going back from the latest one with a
+		# fixed interval; every year if the country has less than count of them
+		years = self.store.country_years(country)
+		interval = len(years) // count
+		if interval == 0:
+			return years
+		idx = len(years) - 1 - interval * np.arange(count)
+		return np.sort(years[idx[idx > 0]])
+
+	def sampled_counts(self, country, count=5):
+		# head count of every bucket in the sampled years, one row per (year, bucket)
+		years = self.sample_years(country, count=count)
+		i = self.store.country_code(country)
+		pos = self.store.rows[i, np.searchsorted(self.store.years, years)]
+		values = self.counts[pos, 0]
+		return pd.DataFrame({
+			'Idx': np.tile(np.arange(len(AGE_RANGES)), len(years)),
+			'Population Ages': np.tile(AGE_RANGES, len(years)),
+			'Year': np.repeat(years, len(AGE_RANGES)),
+			'Population': values.ravel(),
+		})
+
+	def median_bucket(self, pos):
+		# index of the bucket holding the median of the total population, None if
+		# the shares have gaps before reaching it
+		bucket = self.median_buckets[pos]
+		return bucket if bucket >= 0 else None
+
+
+class YearSlices:
+	# the rows of a store split ahead of time by indicator and year: for every
+	# indicator the years in which some row has a value, and for every such year
+	# a ready-made frame of those rows, restricted to columns plus the indicator
+
+	def __init__(self, store, indicators, columns):
+		# the data they were cut from, memo keys use it like a store's
+		self.version = store.version
+		self.years = {}
+		self._slices = {}
+		self._frames = {}
+		for indicator in indicators:
+			cols = list(columns) + [indicator]
+			rows = np.flatnonzero(store.df[cols].notna().all(axis=1).to_numpy())
+			rows = rows[np.argsort(store.year_codes[rows], kind='stable')]
+			year_codes = store.year_codes[rows]
+			frame = freeze(store.df.take(rows)[cols].reset_index(drop=True))
+			starts = np.flatnonzero(np.diff(year_codes, prepend=-1))
+			ends = np.append(starts[1:], len(rows))
+			self.years[indicator] = [year.item() for year in store.years[year_codes[starts]]]
+			self._frames[indicator] = frame, store.years[year_codes]
+			for year, start, end in zip(self.years[indicator], starts, ends):
+				self._slices[indicator, year] = frame.iloc[start:end]
+			self._slices[indicator, None] = frame.iloc[:0]
+
+	def get(self, indicator, year):
+		# rows having the indicator in that year, an empty frame if there are none
+		return self._slices.get((indicator, year), self._slices[indicator, None])
+
+	def all_years(self, indicator):
+		# every row having the indicator, by year, with its 'Year'
+		frame, years = self._frames[indicator]
+		return frame.assign(Year=years)
+
+
+class Availability:
+	# which cells of a store have a value, as a country x indicator x year boolean
+	# array. The masks of an indicator set (a pair, usually) are derived once and
+	# then answer the sidebars without touching the rows.
+
+	def __init__(self, store, indicators):
+		self.store = store
+		self.indicators = list(indicators)
+		self._indicator_index = {indicator: k for k, indicator in enumerate(self.indicators)}
+		self.present = np.stack([~np.isnan(store.matrix(indicator)) for indicator in self.indicators], axis=1)
+		self.present.flags.writeable = False
+		self._masks = {}
+
+	def _mask(self, indicators):
+		# (country x year cells with all the indicators, years with any such cell,
+		# countries with any such cell)
+		key = frozenset(indicators)
+		if key not in self._masks:
+			cells = self.present[:, [self._indicator_index[indicator] for indicator in key]].all(axis=1)
+			self._masks[key] = cells, cells.any(axis=0), cells.any(axis=1)
+		return self._masks[key]
+
+	def years(self, indicators):
+		# sorted years in which some country has all the indicators
+		_, years, _ = self._mask(indicators)
+		return self.store.years[years]
+
+	def overlaps(self, country, indicators):
+		# whether the country has all the indicators in some year
+		_, _, countries = self._mask(indicators)
+		return bool(countries[self.store.country_code(country)])
+
+	def rows(self, indicators, year):
+		# row positions of the countries having all the indicators in that year, in country order
+		j = self.store.year_code(year)
+		if j is None:
+			return np.empty(0, dtype=np.int64)
+		cells, _, _ = self._mask(indicators)
+		return self.store.rows[cells[:, j], j]
+
+	def all_rows(self, indicators):
+		# row positions of every country and year having all the indicators, by year
+		# and then country
+		cells, _, _ = self._mask(indicators)
+		return self.store.rows.T[cells.T]
+
+
+class Ranking:
+	# the countries of a store in rank order for every indicator and year, sorted
+	# once so a top or bottom n is a slice of n positions
+
+	def __init__(self, store, indicators):
+		self.store = store
+		self.indicators = list(indicators)
+		self._order = {}
+		self._counts = {}
+		for indicator in self.indicators:
+			values = store.matrix(indicator)
+			# year x country, highest value first; NaN sorts last and is not counted
+			order = np.argsort(-values.T, axis=1, kind='stable').astype(np.int32)
+			order.flags.writeable = False
+			self._order[indicator] = order
+			self._counts[indicator] = (~np.isnan(values)).sum(axis=0)
+
+	def years(self, indicator):
+		# sorted years in which some country has the indicator
+		return self.store.years[self._counts[indicator] > 0]
+
+	def top(self, indicator, year, n):
+		# the n countries with the highest values in that year, highest first
+		j = self.store.year_code(year)
+		if j is None:
+			return self.store.countries[:0]
+		return self.store.countries[self._order[indicator][j, :min(n, self._counts[indicator][j])]]
+
+	def bottom(self, indicator, year, n):
+		# the n countries with the lowest values in that year, lowest first
+		j = self.store.year_code(year)
+		if j is None:
+			return self.store.countries[:0]
+		count = self._counts[indicator][j]
+		return self.store.countries[self._order[indicator][j, max(count - n, 0):count][::-1]]
@@ -0,0 +1,246 @@
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+import streamlit as st
+import pandas as pd
+
+import lazy
+import memo
+
+alt = lazy.lazy_module('altair')
+
+
+# where every view run also writes the metrics, as JSON if the name ends with
+# .json and in the Prometheus text format otherwise; nothing is written if unset
+METRICS_FILE = os.environ.get('A3_METRICS_FILE')
+# stages of a view run, in the order they happen:
+#   load      data loaders, a cache lookup or the CSV read and indexing on a miss
+#   filter    selecting and shaping the rows of the charts
+#   chart     building the Altair charts
+#   to_dict   serializing a chart, only when payloads are measured
+#   transfer  st.altair_chart or st.vega_lite_chart, which serialize and send it
+#   other     text and widgets after the last chart
+STAGES = ['load', 'filter', 'chart', 'to_dict', 'transfer', 'other']
+# run durations kept per view for the quantiles
+HISTORY = 500
+QUANTILES = [0.5, 0.9, 0.99]
+
+_lock = threading.Lock()
+_views = {}
+# the run of the view executing in this thread, and the last one which finished
+_local = threading.local()
+
+
+class Run:
+	# stage timings of one execution of a view, as consecutive laps
+
+	def __init__(self, view, measure_payloads):
+		self.view = view
+		self.measure_payloads = measure_payloads
+		self.start = self._last = time.perf_counter()
+		self.seconds = 0.0
+		self.stages = collections.defaultdict(float)
+		self.payloads = []
+
+	def lap(self, stage):
+		# the time since the previous lap goes to stage
+		now = time.perf_counter()
+		self.stages[stage] += now - self._last
+		self._last = now
+
+	def finish(self):
+		self.lap('other')
+		self.seconds = self._last - self.start
+
+
+class ViewMetrics:
+	# totals over every run of one view
+
+	def __init__(self):
+		self.runs = 0
+		self.seconds = 0.0
+		self.durations = collections.deque(maxlen=HISTORY)
+		self.stages = collections.defaultdict(float)
+		self.charts_measured = 0
+		self.payload_bytes = 0
+		self.payload_max_bytes = 0
+
+	def add(self, run):
+		self.runs += 1
+		self.seconds += run.seconds
+		self.durations.append(run.seconds)
+		for stage, seconds in run.stages.items():
+			self.stages[stage] += seconds
+		self.charts_measured += len(run.payloads)
+		self.payload_bytes += sum(run.payloads)
+		self.payload_max_bytes = max([self.payload_max_bytes] + run.payloads)
+
+	def quantiles(self):
+		durations = sorted(self.durations)
+		if not durations:
+			return {}
+		return {q: durations[int(q * (len(durations) - 1))] for q in QUANTILES}
+
+
+def debug_enabled():
+	# the debug panel is opt-in: run with A3_DEBUG=1 or open the app with ?debug
+	if os.environ.get('A3_DEBUG'):
+		return True
+	params = st.experimental_get_query_params() or {}
+	return 'debug' in params
+
+
+def view(func):
+	# times every run of a view function, see lap() and altair_chart() for the stages
+	@functools.wraps(func)
+	def wrapper(*args, **kwargs):
+		# payloads are only measured on demand, it costs another to_dict() per chart
+		run = Run(func.__name__, bool(METRICS_FILE) or debug_enabled())
+		_local.run = run
+		try:
+			return func(*args, **kwargs)
+		finally:
+			_local.run = None
+			run.finish()
+			_local.last = run
+			with _lock:
+				_views.setdefault(run.view, ViewMetrics()).add(run)
+			if METRICS_FILE:
+				write_metrics(METRICS_FILE)
+	return wrapper
+
+
+def lap(stage):
+	# closes a stage of the running view, a no-op outside of one
+	run = getattr(_local, 'run', None)
+	if run is not None:
+		run.lap(stage)
+
+
+def spec_size(spec):
+	# size of a spec from spec_cache as JSON, with its datasets inlined the way
+	# Altair's to_dict() would
+	datasets = {name: alt.utils.sanitize_dataframe(df).to_dict(orient='records') for name, df in spec['datasets'].items()}
+	return len(json.dumps(dict(spec, datasets=datasets), separators=(',', ':')))
+
+
+def altair_chart(chart, **kwargs):
+	# st.altair_chart, timing the chart construction before it and the transfer.
+	# Takes the specs of spec_cache too, which go to st.vega_lite_chart.
+	lap('chart')
+	run = getattr(_local, 'run', None)
+	if run is not None and run.measure_payloads:
+		if isinstance(chart, dict):
+			run.payloads.append(spec_size(chart))
+		else:
+			with alt.data_transformers.enable('default', max_rows=None):
+				spec = chart.to_dict()
+			run.payloads.append(len(json.dumps(spec, separators=(',', ':'))))
+		lap('to_dict')
+	if isinstance(chart, dict):
+		result = st.vega_lite_chart(chart, **kwargs)
+	else:
+		result = st.altair_chart(chart, **kwargs)
+	lap('transfer')
+	return result
+
+
+def snapshot():
+	# every metric as plain data: per view runs, latency quantiles, stage totals
+	# and payload sizes, and the counters of every memoized helper
+	with _lock:
+		views = {name: {
+			'runs': metrics.runs,
+			'seconds': metrics.seconds,
+			'quantiles': {str(q): seconds for q, seconds in metrics.quantiles().items()},
+			'stages': dict(metrics.stages),
+			'charts_measured': metrics.charts_measured,
+			'payload_bytes': metrics.payload_bytes,
+			'payload_max_bytes': metrics.payload_max_bytes,
+		} for name, metrics in sorted(_views.items())}
+	return {'views': views, 'caches': memo.stats()}
+
+
+def _labels(**labels):
+	return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+		for key, value in labels.items()) + '}'
+
+
+def prometheus_text(metrics=None):
+	metrics = metrics or snapshot()
+	lines = []
+
+	def family(name, kind, text, samples):
+		lines.append('# HELP {} {}'.format(name, text))
+		lines.append('# TYPE {} {}'.format(name, kind))
+		lines.extend('{}{} {}'.format(sample, _labels(**labels), value) for sample, labels, value in samples)
+
+	views = metrics['views']
+	family('a3_view_seconds', 'summary', 'Duration of a view run.',
+		[('a3_view_seconds', {'view': v, 'quantile': q}, s) for v, m in views.items() for q, s in m['quantiles'].items()]
+		+ [('a3_view_seconds_sum', {'view': v}, m['seconds']) for v, m in views.items()]
+		+ [('a3_view_seconds_count', {'view': v}, m['runs']) for v, m in views.items()])
+	family('a3_view_stage_seconds_total', 'counter', 'Time spent in each stage of a view.',
+		[('a3_view_stage_seconds_total', {'view': v, 'stage': s}, m['stages'][s])
+			for v, m in views.items() for s in STAGES if s in m['stages']])
+	family('a3_chart_payload_bytes_total', 'counter', 'Size of the measured chart specs, as JSON.',
+		[('a3_chart_payload_bytes_total', {'view': v}, m['payload_bytes']) for v, m in views.items()])
+	family('a3_charts_measured_total', 'counter', 'Charts whose spec size was measured.',
+		[('a3_charts_measured_total', {'view': v}, m['charts_measured']) for v, m in views.items()])
+	family('a3_chart_payload_max_bytes', 'gauge', 'Size of the largest measured chart spec.',
+		[('a3_chart_payload_max_bytes', {'view': v}, m['payload_max_bytes']) for v, m in views.items()])
+
+	caches = metrics['caches']
+	family('a3_cache_hits_total', 'counter', 'Calls of a memoized helper answered from its cache.',
+		[('a3_cache_hits_total', {'cache': c}, s['hits']) for c, s in caches.items()])
+	family('a3_cache_misses_total', 'counter', 'Calls of a memoized helper which computed their result.',
+		[('a3_cache_misses_total', {'cache': c}, s['misses']) for c, s in caches.items()])
+	family('a3_cache_compute_seconds_total', 'counter', 'Time a memoized helper spent computing on misses.',
+		[('a3_cache_compute_seconds_total', {'cache': c}, s['compute_seconds']) for c, s in caches.items()])
+	family('a3_cache_entries', 'gauge', 'Entries held by the cache of a memoized helper.',
+		[('a3_cache_entries', {'cache': c}, s['size']) for c, s in caches.items()])
+	return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path):
+	metrics = snapshot()
+	text = json.dumps(metrics, indent=1) if path.endswith('.json') else prometheus_text(metrics)
+	# written aside and renamed, a scraper never reads half a file
+	tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+	with open(tmp_path, 'w') as f:
+		f.write(text)
+	os.replace(tmp_path, path)
+
+
+def debug_panel():
+	# timings of the last run of this session and the totals of the process
+	if not debug_enabled():
+		return
+	metrics = snapshot()
+	with st.sidebar.expander("Performance", expanded=True):
+		run = getattr(_local, 'last', None)
+		if run is not None:
+			st.write("Last run of `{}`: {:.0f} ms".format(run.view, run.seconds * 1000))
+			st.table(pd.DataFrame({'ms': [round(run.stages[s] * 1000, 1) for s in STAGES if s in run.stages]},
+				index=[s for s in STAGES if s in run.stages]))
+			if run.payloads:
+				st.write("Chart payloads: " + ', '.join('{:,} bytes'.format(size) for size in run.payloads))
+		st.write("Views")
+		st.dataframe(pd.DataFrame([{
+			'view': name,
+			'runs': m['runs'],
+			'mean ms': round(m['seconds'] / m['runs'] * 1000, 1),
+			'p90 ms': round(m['quantiles'].get('0.9', 0) * 1000, 1),
+			'max payload': m['payload_max_bytes'],
+		} for name, m in metrics['views'].items()]))
+		st.write("Caches")
+		st.dataframe(pd.DataFrame([dict(cache=name.split('.', 1)[-1], **stats) for name, stats in metrics['caches'].items()]))
+
+
+def clear():
+	with _lock:
+		_views.clear()
@@ -0,0 +1,17 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+	# stands in for a module which is only imported when one of its attributes is
+	# first used; the import lock of importlib makes that safe from any thread
+
+	def __getattr__(self, attr):
+		module = importlib.import_module(self.__name__)
+		# later lookups find the attributes without coming here
+		self.__dict__.update(module.__dict__)
+		return getattr(module, attr)
+
+
+def lazy_module(name):
+	return LazyModule(name)
@@ -0,0 +1,137 @@
+import collections
+import functools
+import threading
+import time
+
+
+# every memoized function keeps its cache here, under its module and qualified
+# name, so a function defined again by a Streamlit rerun (or nested in a view)
+# finds the entries of the previous run
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class LRUCache:
+	# bounded mapping which evicts the least recently used entry, counting hits and
+	# misses and the time spent computing the values of the misses
+
+	def __init__(self, maxsize):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self.compute_seconds = 0.0
+		self._entries = collections.OrderedDict()
+		self._lock = threading.Lock()
+		# a lock per key being computed, see memoize()
+		self._computing = {}
+
+	def get(self, key):
+		# returns (True, value) on a hit and (False, None) on a miss
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return True, self._entries[key]
+			self.misses += 1
+			return False, None
+
+	def peek(self, key):
+		# get() without counting or reordering
+		with self._lock:
+			if key in self._entries:
+				return True, self._entries[key]
+			return False, None
+
+	def computing(self, key):
+		# the lock a miss of key is computed under, so concurrent callers (a
+		# session and the background warm-up) compute it once
+		with self._lock:
+			return self._computing.setdefault(key, threading.Lock())
+
+	def computed(self, key, lock):
+		# drops the lock of key once its computation ended, failed or not; unless
+		# another computation has started under a new one meanwhile
+		with self._lock:
+			if self._computing.get(key) is lock:
+				del self._computing[key]
+
+	def put(self, key, value, seconds=0.0):
+		with self._lock:
+			self.compute_seconds += seconds
+			self._entries[key] = value
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.hits = 0
+			self.misses = 0
+			self.compute_seconds = 0.0
+
+	def stats(self):
+		return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize,
+			'compute_seconds': self.compute_seconds}
+
+
+def cache_key(value):
+	# data stores are keyed by their version instead of their content, sequences
+	# and arrays by their items; anything else has to be hashable already
+	version = getattr(value, 'version', None)
+	if version is not None:
+		return ('version', version)
+	if isinstance(value, (list, tuple)):
+		return tuple(cache_key(v) for v in value)
+	if hasattr(value, 'tolist'):
+		return cache_key(value.tolist())
+	return value
+
+
+def named_cache(name, maxsize=128):
+	# the registered cache of that name, created on first use
+	with _caches_lock:
+		return _caches.setdefault(name, LRUCache(maxsize))
+
+
+def memoize(maxsize=128):
+	# caches the results of func by its (small, scalar) arguments; the results are
+	# shared by every session, so callers must not modify them
+	def decorator(func):
+		cache = named_cache('{}.{}'.format(func.__module__, func.__qualname__), maxsize)
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			key = (cache_key(args), cache_key(sorted(kwargs.items())))
+			found, value = cache.get(key)
+			if not found:
+				lock = cache.computing(key)
+				with lock:
+					try:
+						# another thread may have computed it meanwhile
+						found, value = cache.peek(key)
+						if not found:
+							start = time.perf_counter()
+							value = func(*args, **kwargs)
+							cache.put(key, value, time.perf_counter() - start)
+					finally:
+						cache.computed(key, lock)
+			return value
+
+		wrapper.cache = cache
+		return wrapper
+	return decorator
+
+
+def stats():
+	# hits, misses, size and compute time of every cache, by function name
+	with _caches_lock:
+		caches = sorted(_caches.items())
+	return {name: cache.stats() for name, cache in caches}
+
+
+def clear():
+	with _caches_lock:
+		caches = list(_caches.values())
+	for cache in caches:
+		cache.clear()
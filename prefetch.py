@@ -0,0 +1,77 @@
+import concurrent.futures
+import os
+import sys
+import threading
+
+
+# slider steps on each side of the selected one computed ahead (0 turns the
+# prefetching off), and the threads computing them
+PREFETCH_STEPS = int(os.environ.get('A3_PREFETCH_STEPS', '2'))
+PREFETCH_WORKERS = int(os.environ.get('A3_PREFETCH_WORKERS', '2'))
+
+_lock = threading.Lock()
+_executor = None
+# the scope and the queued work of every (session, group), see around()
+_pending = {}
+
+
+def session_id():
+	# the session whose script run is in this thread; None outside of the
+	# Streamlit runtime (which loads the module), like in the benchmark
+	scriptrunner = sys.modules.get('streamlit.runtime.scriptrunner')
+	ctx = scriptrunner.get_script_run_ctx() if scriptrunner is not None else None
+	return ctx.session_id if ctx is not None else None
+
+
+def neighbours(options, value, steps):
+	# the options up to steps away from value, nearest first
+	options = list(options)
+	if value not in options:
+		return []
+	i = options.index(value)
+	found = []
+	for step in range(1, steps + 1):
+		found += [options[j] for j in (i + step, i - step) if 0 <= j < len(options)]
+	return found
+
+
+def cancel():
+	# drops the queued work of every session, for when the data it would be
+	# computed from is gone; work already running is left to finish
+	with _lock:
+		for _, futures in _pending.values():
+			for future in futures.values():
+				future.cancel()
+		_pending.clear()
+
+
+def around(group, scope, options, value, compute):
+	# calls compute(option) in the background for the options next to value, so
+	# stepping a slider finds its charts cached; compute has to be memoized. The
+	# scope is what else the charts depend on (the country, the indicator): work
+	# queued for another scope of the group, or for options no longer next to
+	# value, is dropped; work already running is left to finish. Every session
+	# has its own queue, one user's reruns never drop another's work.
+	global _executor
+	targets = neighbours(options, value, PREFETCH_STEPS)
+	key = (session_id(), group)
+	with _lock:
+		if _executor is None:
+			_executor = concurrent.futures.ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix='prefetch')
+		# forget the queues whose work is all done, like those of closed sessions
+		for done in [k for k, (_, futures) in _pending.items() if k != key and all(f.done() for f in futures.values())]:
+			del _pending[done]
+		previous_scope, futures = _pending.pop(key, (None, {}))
+		kept = {}
+		for target, future in futures.items():
+			if previous_scope == scope and target in targets and not future.cancelled():
+				kept[target] = future
+			else:
+				future.cancel()
+		for target in targets:
+			if target not in kept:
+				kept[target] = _executor.submit(compute, target)
+		if kept:
+			_pending[key] = (scope, kept)
+	return targets
+
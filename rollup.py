@@ -0,0 +1,162 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+# population weighted quantiles kept besides the mean, as q10 ... q90 columns
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+# bump when the table changes, its snapshots and year digests are keyed by it
+SCHEMA = 1
+# every country belongs to the world, the other levels come from a membership
+# table with one column per level
+WORLD = 'World'
+LEVELS = ['Region', 'Income Group']
+
+
+def quantile_column(q):
+	return 'q{:d}'.format(int(round(q * 100)))
+
+
+def groups(countries, membership):
+	# (level, group, country positions) of the world and of every group of the
+	# levels membership has; membership has 'Country Name' and a column per level
+	found = [(WORLD, WORLD, np.arange(len(countries)))]
+	if membership is None:
+		return found
+	index = pd.Index(countries)
+	for level in LEVELS:
+		if level not in membership.columns:
+			continue
+		rows = membership[membership[level].notna()]
+		positions = index.get_indexer(rows['Country Name'])
+		for group in sorted(rows[level].unique()):
+			members = positions[(rows[level] == group).to_numpy() & (positions >= 0)]
+			if len(members):
+				found.append((level, group, np.sort(members)))
+	return found
+
+
+def weighted_stats(values, weights):
+	# mean and QUANTILES of values (indicator x country x year) over the countries,
+	# weighted by weights (country x year); also the number of countries and the
+	# population behind them. NaN where no country has both a value and a weight.
+	present = ~np.isnan(values) & (np.nan_to_num(weights) > 0)
+	w = np.where(present, weights, 0.0)
+	total = w.sum(axis=1)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		mean = (np.where(present, values, 0.0) * w).sum(axis=1) / total
+	# the values of every indicator and year in ascending order, missing ones last,
+	# and the population share reached at each of them
+	order = np.argsort(np.where(present, values, np.inf), axis=1, kind='stable')
+	ordered = np.take_along_axis(values, order, axis=1)
+	reached = np.cumsum(np.take_along_axis(w, order, axis=1), axis=1)
+	quantiles = []
+	for q in QUANTILES:
+		# the first value at which q of the population is reached
+		i = np.minimum((reached < q * total[:, None, :]).sum(axis=1), values.shape[1] - 1)
+		quantiles.append(np.take_along_axis(ordered, i[:, None, :], axis=1)[:, 0, :])
+	empty = total == 0
+	return {
+		'Mean': np.where(empty, np.nan, mean),
+		**{quantile_column(q): np.where(empty, np.nan, value) for q, value in zip(QUANTILES, quantiles)},
+		'Countries': present.sum(axis=1),
+		'Population': total,
+	}
+
+
+def year_digests(store, population, membership, indicators):
+	# one digest per year of everything the rollups of that year are computed
+	# from, so a rebuild only recomputes the years which changed
+	base = hashlib.sha1(repr((SCHEMA, list(indicators), list(store.countries), QUANTILES)).encode('utf-8'))
+	if membership is not None:
+		base.update(pd.util.hash_pandas_object(membership, index=False).to_numpy().tobytes())
+	# year x (indicators and population) x country, so every year is one block
+	by_year = np.ascontiguousarray(np.stack([store.matrix(indicator) for indicator in indicators] + [population]).transpose(2, 0, 1))
+	digests = []
+	for year, values in zip(store.years, by_year):
+		sha = base.copy()
+		sha.update(np.asarray(year).tobytes())
+		sha.update(values.tobytes())
+		digests.append(sha.hexdigest()[:16])
+	return digests
+
+
+def compute(store, population, membership, indicators, years):
+	# the rollup rows of the given year positions, see table()
+	values = np.stack([store.matrix(indicator)[:, years] for indicator in indicators])
+	weights = population[:, years]
+	frames = []
+	for level, group, members in groups(store.countries, membership):
+		stats = weighted_stats(values[:, members], weights[members])
+		frames.append(pd.DataFrame({
+			'Level': level,
+			'Group': group,
+			'Indicator': np.repeat(indicators, len(years)),
+			'Year': np.tile(store.years[years], len(indicators)),
+			**{name: stat.ravel() for name, stat in stats.items()},
+		}))
+	return pd.concat(frames, ignore_index=True)
+
+
+def table(store, population, membership, indicators, previous=None):
+	# population weighted mean and quantiles of every indicator for the world and
+	# every group of membership, one row per (level, group, indicator, year);
+	# population is a country x year array over the store. The rows of previous
+	# (an earlier table) are kept for the years whose inputs are unchanged.
+	indicators = list(indicators)
+	digests = year_digests(store, population, membership, indicators)
+	kept = None
+	changed = np.arange(len(store.years))
+	if previous is not None and 'Digest' in previous.columns:
+		reusable = set(previous['Digest'].astype(str)) & set(digests)
+		kept = previous[previous['Digest'].astype(str).isin(reusable)]
+		changed = np.array([j for j, digest in enumerate(digests) if digest not in reusable], dtype=int)
+	parts = [] if kept is None else [pd.DataFrame({col: kept[col].to_numpy() for col in kept.columns})]
+	if len(changed):
+		computed = compute(store, population, membership, indicators, changed)
+		year_digest = dict(zip(store.years[changed], np.asarray(digests)[changed]))
+		parts.append(computed.assign(Digest=computed['Year'].map(year_digest)))
+	df = pd.concat(parts, ignore_index=True)
+	df = df.sort_values(['Level', 'Group', 'Indicator', 'Year'], kind='stable').reset_index(drop=True)
+	return df.astype({'Level': 'category', 'Group': 'category', 'Indicator': 'category', 'Digest': 'category'})
+
+
+def levels(membership):
+	# the levels there are rollups for, the world first
+	found = [WORLD]
+	if membership is not None:
+		found += [level for level in LEVELS if level in membership.columns and membership[level].notna().any()]
+	return found
+
+
+def group_names(df, level):
+	# the groups of one level of a table, sorted
+	return sorted(df.loc[(df['Level'] == level).to_numpy(), 'Group'].astype(str).unique())
+
+
+def series(df, level, group_names, indicators):
+	# the population weighted means of some groups of one level, one row per
+	# (group, year) and one column per indicator; the groups in 'Country Name'
+	# so they chart like countries
+	rows = df[(df['Level'] == level).to_numpy() & df['Group'].isin(group_names).to_numpy()
+		& df['Indicator'].isin(indicators).to_numpy()]
+	wide = rows.assign(Group=rows['Group'].astype(str), Indicator=rows['Indicator'].astype(str)).pivot(
+		index=['Group', 'Year'], columns='Indicator', values='Mean')
+	wide = wide.reset_index().rename(columns={'Group': 'Country Name'})
+	wide.columns.name = None
+	for indicator in indicators:
+		if indicator not in wide.columns:
+			wide[indicator] = np.nan
+	return wide[['Country Name', 'Year'] + list(indicators)]
+
+
+def aligned(store, other, column):
+	# a column of another store as a country x year array over this store, NaN
+	# for the countries and years the other store has no row for
+	i = pd.Index(other.countries).get_indexer(store.countries)
+	j = pd.Index(other.years).get_indexer(store.years)
+	values = other.matrix(column)[np.ix_(np.maximum(i, 0), np.maximum(j, 0))].copy()
+	values[i < 0] = np.nan
+	values[:, j < 0] = np.nan
+	return values
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+
+# neighbours kept for every country, and the fewest years two countries have to
+# share for an indicator to count towards their distance
+NEIGHBOURS = 20
+MIN_OVERLAP = 10
+# bump when the table changes, its snapshots are keyed by it
+SCHEMA = 1
+
+
+def zscores(store, indicators):
+	# indicator x country x year, every indicator standardized over all countries
+	# and years so they weigh the same and levels count, not only shapes
+	values = np.stack([store.matrix(indicator) for indicator in indicators])
+	with np.errstate(invalid='ignore', divide='ignore'):
+		mean = np.nanmean(values, axis=(1, 2), keepdims=True)
+		std = np.nanstd(values, axis=(1, 2), keepdims=True)
+		return (values - mean) / np.where(std > 0, std, 1.0)
+
+
+def distances(z):
+	# distance of every pair of countries: per indicator the root mean square
+	# difference over the years both have a value, averaged over the indicators
+	# they share MIN_OVERLAP years of; inf where they share no such indicator.
+	# Also the number of those indicators and the most years shared for one of
+	# them. All pairs and indicators at once, as batched products of indicator x
+	# country x year arrays.
+	present = ~np.isnan(z)
+	x = np.where(present, z, 0.0)
+	m = present.astype(float)
+	squares = (x * x) @ m.transpose(0, 2, 1)
+	shared = m @ m.transpose(0, 2, 1)
+	# sum over shared years of (a - b)^2 = a^2 + b^2 - 2ab
+	sums = squares + squares.transpose(0, 2, 1) - 2.0 * (x @ x.transpose(0, 2, 1))
+	counted = shared >= MIN_OVERLAP
+	with np.errstate(invalid='ignore', divide='ignore'):
+		rms = np.sqrt(np.maximum(sums, 0.0) / shared)
+		indicators = counted.sum(axis=0)
+		distance = np.where(counted, rms, 0.0).sum(axis=0) / indicators
+	distance[indicators == 0] = np.inf
+	np.fill_diagonal(distance, np.inf)
+	return distance, indicators, np.where(counted, shared, 0.0).max(axis=0)
+
+
+def table(store, indicators, neighbours=NEIGHBOURS):
+	# the nearest countries of every country by the trajectories of indicators,
+	# nearest first, with the distance, the number of indicators it was measured
+	# over and the most years they shared for one of them
+	distance, compared, years = distances(zscores(store, indicators))
+	k = min(neighbours, len(store.countries) - 1)
+	nearest = np.argsort(distance, axis=1, kind='stable')[:, :k]
+	rows = np.repeat(np.arange(len(store.countries)), k)
+	cols = nearest.ravel()
+	df = pd.DataFrame({
+		'Country Name': pd.Categorical(store.countries[rows], categories=store.countries),
+		'Rank': np.tile(np.arange(1, k + 1), len(store.countries)).astype(np.int16),
+		'Similar Country': store.countries[cols],
+		'Distance': distance[rows, cols],
+		'Indicators': compared[rows, cols].astype(np.int16),
+		'Years Compared': years[rows, cols].astype(np.int16),
+	})
+	return df[np.isfinite(df['Distance'])].reset_index(drop=True)
+
+
+def similar(df, country, n=10):
+	# the n countries most like country, nearest first
+	return df[(df['Country Name'] == country).to_numpy()].head(n)
@@ -0,0 +1,55 @@
+import contextlib
+import threading
+import time
+
+import lazy
+import memo
+
+alt = lazy.lazy_module('altair')
+
+
+# compiled Vega-Lite specs, by chart key and the shape of the chart's data
+_templates = memo.named_cache('spec_cache.templates', maxsize=256)
+# data transformers and themes are global to Altair, one compilation at a time
+_compile_lock = threading.Lock()
+
+
+def data_signature(df):
+	# what Altair infers the encoding types from: the columns and their dtypes
+	return tuple((col, df[col].dtype.kind) for col in df.columns)
+
+
+def compile_chart(chart, data):
+	# the spec of chart with the frames of data as named datasets, named by their
+	# keyword; frames the chart brought itself are kept aside as constants
+	names = {id(df): name for name, df in data.items()}
+	constants = {}
+
+	def to_name(df):
+		if id(df) not in names:
+			names[id(df)] = 'constant-{}'.format(len(constants))
+			constants[names[id(df)]] = df
+		return {'name': names[id(df)]}
+
+	with _compile_lock:
+		alt.data_transformers.register('spec_cache', to_name)
+		# st.altair_chart drops Altair's default theme as well
+		theme = alt.themes.enable('none') if alt.themes.active == 'default' else contextlib.nullcontext()
+		with theme, alt.data_transformers.enable('spec_cache'):
+			spec = chart.to_dict()
+	return spec, constants
+
+
+def chart(key, build, **data):
+	# the spec of the chart build(**data) returns, with data as its datasets, for
+	# st.vega_lite_chart. The chart is built and validated once per key and shape
+	# of data, afterwards only the datasets change; so key must hold everything
+	# else the chart depends on, like the encoded columns and scale domains.
+	template_key = (memo.cache_key(key), tuple((name, data_signature(df)) for name, df in sorted(data.items())))
+	found, template = _templates.get(template_key)
+	if not found:
+		start = time.perf_counter()
+		template = compile_chart(build(**data), data)
+		_templates.put(template_key, template, time.perf_counter() - start)
+	spec, constants = template
+	return dict(spec, datasets=dict(constants, **data))
@@ -1,8 +1,26 @@
+import hashlib
+import importlib
+import os
+import threading
+
 import streamlit as st
 import numpy as np
 import pandas as pd
-import altair as alt
-import math
+
+import chart_data
+import correlation
+import data_source
+import data_store
+import instrument
+import lazy
+import memo
+import prefetch
+import rollup
+import similarity
+import spec_cache
+
+# imported on first use, the Overview page does without it
+alt = lazy.lazy_module('altair')
 
 
 OVERVIEW = "Overview"
@@ -11,19 +29,54 @@ VAR_RELATIONSHIP_PER_COUNTRY = "Health & Economy Interaction, per Country"
 ONE_VAR_ACROSS_REGION = "Health / Economy over the World"
 SINGLE_FACTOR_OVER_TIME = 'Life Expectancies & Other Indicators'
 POINT2_PLACEHOLDER = 'Health & Economy Interaction, per Year'
-# locations of data
-HEALTH_URL = "https://raw.githubusercontent.com/CMU-IDS-2020/a3-05839_a3/master/data/health.csv"
-OTHER_DATA_URL = "https://raw.githubusercontent.com/CMU-IDS-2020/a3-05839_a3/master/data/merged_data_country_only_with_id_lat_lon.csv"
-MERGED_URL = "https://raw.githubusercontent.com/CMU-IDS-2020/a3-05839_a3/master/data/merged_data_country_only.csv"
+# locations of data, see data_source.DATASETS for the csv files
 WORLD_MAP_URL = "https://raw.githubusercontent.com/vega/vega-datasets/master/data/world-110m.json"
 # locations of markdowns
 
+# world map detail levels bundled by build_data.py, see build_data.MAP_LEVELS
+MAP_DETAILS = {'Full': 'full', 'Medium': 'medium', 'Low': 'low'}
+# level of detail of the all countries life expectancy chart, and the most
+# (in years of life expectancy) a simplified line may be off from the data
+LINE_DETAILS = ['Band only', 'Simplified', 'Full']
+LINE_TOLERANCE = 0.25
+# columns of the world map data, besides the selected indicator
+MAP_COLUMNS = ['Country Name', 'id', 'Latitude (average)', 'Longitude (average)']
+ECON_INDICATORS = ['Gini', 'GDP per capita (current US$)', 'Unemployment, total (% of total labor force)']
+HEALTH_INDICATORS = ['Current health expenditure (% of GDP)', 'Current health expenditure per capita (current US$)',
+	'Life expectancy at birth, total (years)']
+# derived from the age shares of the health data, see data_store.age_summary()
+AGE_INDICATORS = data_store.AGE_INDICATORS
+# columns each view loads, the others of a dataset are never read. The population
+# page needs the total population and the age shares (those the file has)
+HEALTH_COLUMNS = ['Country Name', 'Year', 'Population, total'] + [
+	data_store.age_share_column(age_range, sex) for sex in data_store.SEXES for age_range in data_store.AGE_RANGES]
+AGE_SHARE_COLUMNS = ['Country Name', 'Year'] + [data_store.age_share_column(age_range, 'total') for age_range in data_store.AGE_RANGES]
+OTHER_COLUMNS = ['Country Name', 'Year'] + ECON_INDICATORS + HEALTH_INDICATORS + MAP_COLUMNS[1:]
+MERGE_COLUMNS = ['Country Name', 'Year'] + ECON_INDICATORS + HEALTH_INDICATORS
+REGION_COLUMNS = ['Country Name'] + rollup.LEVELS
+# the data caches are filled in the background once the Overview is served,
+# unless A3_WARM_UP=0; every view still loads what it misses itself
+WARM_UP = os.environ.get('A3_WARM_UP', '1') != '0'
+# with A3_SHARED_DATA=1 the frames of load_health_data, load_other_data and
+# load_merge_data are published once per node and memory-mapped by every worker
+# process, see derived_frame(); bump DERIVED_SCHEMA when their derivation changes
+SHARED_DATA = os.environ.get('A3_SHARED_DATA') == '1'
+DERIVED_SCHEMA = 2
+
 
 def main():
+	if data_source.refreshed(data_source.DATASETS):
+		# a dataset changed on disk: the caches let go of the old snapshots and
+		# the next loads map the new ones, published by whichever worker is first.
+		# In every mode, as the datasets read their columns lazily from the
+		# snapshot of their version and another process may prune it
+		memo.clear()
+		prefetch.cancel()
 	# Add a selector for the app mode on the sidebar.
 	st.sidebar.title("Navigation")
 	vis_topic = st.sidebar.radio("",
-		(str(OVERVIEW), str(POPU_DIST), str(SINGLE_FACTOR_OVER_TIME) , str(POINT2_PLACEHOLDER), str(VAR_RELATIONSHIP_PER_COUNTRY), str(ONE_VAR_ACROSS_REGION)))
+		(str(OVERVIEW), str(POPU_DIST), str(SINGLE_FACTOR_OVER_TIME) , str(POINT2_PLACEHOLDER), str(VAR_RELATIONSHIP_PER_COUNTRY), str(ONE_VAR_ACROSS_REGION)),
+		key='page')
 	if vis_topic == OVERVIEW:
 		# Render main readme, placeholder
 		st.title(OVERVIEW)
@@ -36,6 +89,8 @@ def main():
 		Through the visualizations, we hope you can get insights in economy and population health among countries over the past few decades, 
 		and correlations of economy and health indicators, if any.
 ''')
+		if WARM_UP:
+			start_warm_up()
 	elif vis_topic == POPU_DIST:
 		st.title(POPU_DIST)
 		run_popu_dist()
@@ -51,108 +106,304 @@ def main():
 	elif vis_topic == POINT2_PLACEHOLDER:
 		st.title(POINT2_PLACEHOLDER)
 		run_relationship_per_year_all_countries()
+	# stage timings and cache counters, for ?debug
+	instrument.debug_panel()
+
+
+@memo.memoize()
+def load_dataset(name):
+	# columns are read on first use and shared by the frames of every view
+	return data_source.Dataset(name)
 
 
-@st.cache
-def load_data(url):
-    data = pd.read_csv(url, header=0, skipinitialspace=True)
-    data = data[data['Year'] <= 2017]
+@memo.memoize()
+def load_data(name, columns):
+    # the columns the file does not have are left out
+    dataset = load_dataset(name)
+    data = data_store.freeze(dataset.frame([col for col in columns if col in dataset.column_names]))
     countries = data['Country Name'].unique()
     return data, countries
 
 
-@st.cache
-def group_by_country(df):    
-	return df.groupby(['Country Name'])
+def derived_frame(name, versions, build):
+	# the frame build() returns. In shared mode it is the snapshot published for
+	# the versions of the data it is built from instead, in the row order of
+	# DataStore so the stores over it keep it mapped rather than copy it
+	if not SHARED_DATA:
+		return data_store.freeze(build())
+	stamp = list(versions) + ['derived-{}'.format(DERIVED_SCHEMA)]
+	return data_store.freeze(data_source.shared_frame(name, stamp, lambda: data_store.DataStore(build()).df))
 
 
-@st.cache
+@memo.memoize()
+def last_year():
+	# the last year of the canonical table, build_data.py cuts it at --year-cutoff
+	return load_dataset('canonical').frame(['Year'])['Year'].max().item()
+
+
+@memo.memoize()
 def load_health_data():
-	df, countries = load_data(HEALTH_URL)
+	def build():
+		df, _ = load_data('health', HEALTH_COLUMNS)
+		# the health table is not part of build_data.py yet, so it is cut at the
+		# last year of the canonical one here
+		return df[df['Year'] <= last_year()]
+	df = derived_frame('health_data', [data_source.dataset_version('health'), data_source.dataset_version('canonical')], build)
+	countries = df['Country Name'].unique()
 	return df, countries
 
-@st.cache
+@memo.memoize()
+def load_age_summary():
+	# the AGE_INDICATORS of every country and year of the health table, computed
+	# at once, and the version they are of; None when the health data cannot be
+	# loaded (it is not bundled and the remote copy is out of reach)
+	try:
+		shares, _ = load_data('health', AGE_SHARE_COLUMNS)
+	except OSError:
+		return None, 'no-health'
+	return data_store.age_summary(shares), data_source.dataset_version('health')
+
+
+def age_indicators():
+	# the AGE_INDICATORS the views offer, none without the health data
+	return AGE_INDICATORS if load_age_summary()[0] is not None else []
+
+
+def with_age_indicators(df):
+	# df with the AGE_INDICATORS of its countries and years; NaN where the health
+	# data has no row, or everywhere if it cannot be loaded
+	summary, _ = load_age_summary()
+	if summary is None:
+		return df.assign(**{indicator: np.nan for indicator in AGE_INDICATORS})
+	keys = pd.MultiIndex.from_arrays([summary['Country Name'].astype(object), summary['Year']])
+	pos = keys.get_indexer(pd.MultiIndex.from_arrays([df['Country Name'].astype(object), df['Year']]))
+	return df.assign(**{indicator: np.where(pos >= 0, summary[indicator].to_numpy()[pos], np.nan)
+		for indicator in AGE_INDICATORS})
+
+
+@memo.memoize()
 def load_other_data():
-	df, countries = load_data(OTHER_DATA_URL)
-	df['id'] = df['id'].astype(str)
-	df['id'] = df['id'].str.zfill(3)
-	econ_indicators = df.columns[[3, 6, 8]]
-	health_indicators = df.columns[[4, 5, 7]]
-	return df, countries, econ_indicators, health_indicators
+	def build():
+		# countries which can be placed on the world map; ids are already zero-padded
+		df, _ = load_data('canonical', OTHER_COLUMNS)
+		return with_age_indicators(df[df['id'].notna()])
+	df = derived_frame('other_data', [derived_version('canonical')], build)
+	countries = df['Country Name'].unique()
+	return df, countries, ECON_INDICATORS, HEALTH_INDICATORS
 
 
-@st.cache
+@memo.memoize()
 def load_merge_data():
-	df, countries = load_data(MERGED_URL)
+	df = derived_frame('merge_data', [derived_version('canonical')], lambda: with_age_indicators(load_data('canonical', MERGE_COLUMNS)[0]))
+	countries = df['Country Name'].unique()
 	return df, countries
 
 
-@st.cache
-def data_group_by_country(df):
-	grouped = dict(tuple(group_by_country(df)))
-	return grouped	
+# the stores index each dataset by country and year, so views take slices
+# instead of scanning the whole frame with boolean masks
+@memo.memoize()
+def load_health_store():
+	df, _ = load_health_data()
+	return data_store.DataStore(df, version='{}+{}'.format(data_source.dataset_version('health'), data_source.dataset_version('canonical')))
 
 
-@st.cache
-def keep_only_selected_countries(df, selected_countries):
-	# takes in a dataframe and list of country names
-	# this function will return a dataframe with only data from the specified countries
-	sub_df = df[df['Country Name'].isin(selected_countries)]
-	return sub_df
+@memo.memoize()
+def load_age_table():
+	# age bucket shares and counts of every country and year, built once
+	return data_store.AgeTable(load_health_store())
 
 
-@st.cache
-def dropna_by_feature(df, features):
-	# takes in a dataframe and list of features to checkon,
-	# this function will drop rows which has np.nan in any of the features specifed
-	return df.dropna(how='any', subset=features)
+def derived_version(name):
+	# the frames over canonical carry the age indicators of the health data too,
+	# or NaN in their place when it cannot be loaded
+	return '{}+{}'.format(data_source.dataset_version(name), load_age_summary()[1])
 
-def run_popu_dist():
 
-	@st.cache
-	def get_total_ymax(country_df, health_df):
-		# fixing y range for better visualizing the change
-		maxy = 0.0
-		for col in country_df.columns:
-		    if '% of' in col and 'Population ages' in col:
-		        curr_max = health_df[col].max()
-		        if curr_max > maxy:
-		            maxy = curr_max	
-		return maxy 
-
-	@st.cache
-	def get_only_tens(country_df):
-		years = list(np.sort(country_df['Year'].unique()))
-		# get selection interval
-		interval = math.floor(len(years) / 5)
-		if interval == 0:
-			only_ten = country_df
-		else:
-			temp = []
-			idx = len(years) - 1
-			count = 0
-			while idx > 0 and count < 5:
-				temp.append(years[idx])
-				idx -= interval
-				count += 1
-			only_ten = country_df[country_df['Year'].isin(temp)]
-		return only_ten	
-
-	@st.cache
-	def get_only_ten_general(country_df, age_ranges):
-		only_ten = get_only_tens(country_df)
-		values2 = []
-		years2 = []
-		indexes = []
-		ages = []
-		for _, data_row in only_ten.iterrows():
-			for i in range(len(age_ranges)):
-				values2.append(data_row['Population ages {} (% of total population)'.format(str(age_ranges[i]))] * data_row['Population, total'])
-				years2.append(data_row['Year'])
-				indexes.append(i)
-				ages.append(age_ranges[i])
-		overall_data = pd.DataFrame({'Idx': indexes, 'Population Ages': ages, 'Year': years2, 'Population': values2})
-		return overall_data  	
+@memo.memoize()
+def load_other_store():
+	df, _, _, _ = load_other_data()
+	return data_store.DataStore(df, version=derived_version('canonical') + '-with-id')
+
+
+@memo.memoize()
+def load_merge_store():
+	df, _ = load_merge_data()
+	return data_store.DataStore(df, version=derived_version('canonical'))
+
+
+@memo.memoize()
+def load_map_slices():
+	# world map data of every indicator and year, sliced once
+	_, _, econ_indicators, health_indicators = load_other_data()
+	return data_store.YearSlices(load_other_store(), list(econ_indicators) + list(health_indicators) + age_indicators(), MAP_COLUMNS)
+
+
+@memo.memoize()
+def load_life_expectancy_lines():
+	# every country's life expectancy with the years a line would barely bend at dropped
+	lines = chart_data.simplified_lines(load_merge_store(), 'Life expectancy at birth, total (years)', LINE_TOLERANCE)
+	return chart_data.chart_data(lines, lines.columns)
+
+
+@memo.memoize()
+def load_life_expectancy_band():
+	return chart_data.chart_data(chart_data.quantile_band(load_merge_store(), 'Life expectancy at birth, total (years)'),
+		['Year'] + list(chart_data.BAND_QUANTILES))
+
+
+@memo.memoize()
+def world_map_url(level):
+	# the bundled topology if build_data.py prepared it and static serving is on,
+	# versioned so the browser may cache it for good; the GitHub copy otherwise
+	path = data_source.world_map_file(level)
+	if not (os.path.exists(path) and st.get_option('server.enableStaticServing')):
+		return None
+	with open(path, 'rb') as f:
+		version = hashlib.sha1(f.read()).hexdigest()[:12]
+	return 'app/static/{}?v={}'.format(os.path.basename(path), version)
+
+
+@memo.memoize()
+def load_ranking(store):
+	# the countries of a store in rank order for every indicator and year
+	return data_store.Ranking(store, ECON_INDICATORS + HEALTH_INDICATORS + age_indicators())
+
+
+@memo.memoize()
+def load_correlations(store, across):
+	# every correlation of an economy with a health indicator, by country or by
+	# year (see correlation.ACROSS); computed once per dataset and kept on disk
+	stamp = [store.version, 'correlation-{}'.format(correlation.SCHEMA), correlation.MAX_LAG]
+	return data_store.freeze(data_source.shared_frame('correlations_' + across, stamp,
+		lambda: correlation.table(store, ECON_INDICATORS, HEALTH_INDICATORS, across)))
+
+
+@memo.memoize(maxsize=512)
+def load_strongest(store, across, value):
+	# the strongest correlations of one country or year, as displayed
+	rows = correlation.strongest(load_correlations(store, across), across, value)
+	columns = ['Economy Indicator', 'Health Indicator', 'Lag (years)', 'Pearson r', 'Spearman r', 'Pairs']
+	return data_store.freeze(chart_data.chart_data(rows, columns).reset_index(drop=True))
+
+
+def strongest_relationships(store, across, value):
+	rows = load_strongest(store, across, value)
+	instrument.lap('load')
+	if rows.empty:
+		st.write("Data Not Available")
+	else:
+		st.dataframe(rows)
+
+
+@memo.memoize()
+def load_similarity(store):
+	# the nearest countries of every country by their economy and health
+	# trajectories; computed once per dataset and kept on disk
+	stamp = [store.version, 'similarity-{}'.format(similarity.SCHEMA), similarity.NEIGHBOURS, similarity.MIN_OVERLAP]
+	return data_store.freeze(data_source.shared_frame('similarity', stamp,
+		lambda: similarity.table(store, ECON_INDICATORS + HEALTH_INDICATORS)))
+
+
+@memo.memoize(maxsize=512)
+def load_similar_countries(store, country):
+	rows = similarity.similar(load_similarity(store), country)
+	return data_store.freeze(chart_data.chart_data(rows, ['Similar Country', 'Distance', 'Indicators', 'Years Compared']).reset_index(drop=True))
+
+
+def compare_countries(countries):
+	# opens the life expectancy page with countries selected, for the buttons of other pages
+	st.session_state['page'] = SINGLE_FACTOR_OVER_TIME
+	st.session_state['compare'] = 'Countries'
+	st.session_state['compare_countries'] = list(countries)
+
+
+@memo.memoize()
+def load_membership():
+	# the region and income group of every country and the version of that table,
+	# None unless build_data.py was given the World Bank country metadata
+	try:
+		dataset = data_source.Dataset('regions', remote=False)
+	except FileNotFoundError:
+		return None, None
+	return data_store.freeze(dataset.frame([col for col in REGION_COLUMNS if col in dataset.column_names])), dataset.version
+
+
+@memo.memoize()
+def load_rollups(store):
+	# population weighted means and quantiles of every indicator for the world,
+	# every region and every income group; kept on disk, and a rebuild only
+	# computes the years whose data changed, see rollup.table()
+	membership, version = load_membership()
+	stamp = [store.version, version, 'rollup-{}'.format(rollup.SCHEMA)]
+
+	def build():
+		population = rollup.aligned(store, load_health_store(), 'Population, total')
+		return rollup.table(store, population, membership, ECON_INDICATORS + HEALTH_INDICATORS + AGE_INDICATORS,
+			previous=data_source.read_latest_snapshot('rollups'))
+	return data_store.freeze(data_source.shared_frame('rollups', stamp, build))
+
+
+@memo.memoize(maxsize=256)
+def load_rollup_series(store, level, group_names, factor):
+	# the yearly means of some groups, shaped like the rows of countries the trend chart takes
+	columns = ['Country Name', 'Year', factor, 'Life expectancy at birth, total (years)']
+	df = rollup.series(load_rollups(store), level, group_names, columns[2:]).dropna(how='any', subset=columns[2:])
+	df = df.assign(Year=pd.to_datetime(df['Year'].astype(str), format='%Y'))
+	return data_store.freeze(chart_data.chart_data(df, columns).reset_index(drop=True))
+
+
+@memo.memoize(maxsize=256)
+def load_rollup_spread(store, level, group_names, indicator):
+	# how an indicator spreads over the population of each group, in the last year it has a value
+	df = load_rollups(store)
+	rows = df[(df['Level'] == level).to_numpy() & df['Group'].isin(group_names).to_numpy()
+		& (df['Indicator'] == indicator).to_numpy() & df['Mean'].notna().to_numpy()]
+	rows = rows[rows['Year'] == rows['Year'].max()] if len(rows) else rows
+	columns = ['Group', 'Year', 'Countries', 'Mean'] + [rollup.quantile_column(q) for q in rollup.QUANTILES]
+	return data_store.freeze(chart_data.chart_data(rows.assign(Group=rows['Group'].astype(str)), columns).reset_index(drop=True))
+
+
+@memo.memoize()
+def load_availability(store):
+	# which countries and years of a store have each indicator, so sidebars and
+	# "Data Not Available" checks never scan the rows
+	return data_store.Availability(store, ECON_INDICATORS + HEALTH_INDICATORS)
+
+
+def warm_up():
+	# fills the caches of the views in the order they are likely visited; a
+	# dataset which fails to load is left to its view to report
+	importlib.import_module('altair')
+	loaders = [
+		lambda: load_availability(load_merge_store()),
+		lambda: load_ranking(load_merge_store()),
+		lambda: load_correlations(load_merge_store(), 'countries'),
+		lambda: load_correlations(load_other_store(), 'time'),
+		lambda: load_similarity(load_other_store()),
+		load_life_expectancy_band,
+		load_life_expectancy_lines,
+		lambda: load_availability(load_other_store()),
+		load_map_slices,
+		load_age_table,
+		lambda: load_rollups(load_merge_store()),
+	]
+	for loader in loaders:
+		try:
+			loader()
+		except Exception:
+			continue
+
+
+@memo.memoize()
+def start_warm_up():
+	# once per process, whichever session serves the Overview first
+	thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+	thread.start()
+	return thread
+
+
+@instrument.view
+def run_popu_dist():
 
 	st.markdown('''
 		## Health through the lens of population age distribution
@@ -181,54 +432,51 @@ def run_popu_dist():
 	''')
 
 	# load health data
-	health_df, countries = load_health_data()
-	health_grouped = data_group_by_country(health_df)
+	_, countries = load_health_data()
+	health_store = load_health_store()
+	age_table = load_age_table()
+	instrument.lap('load')
 
 	st.sidebar.header("Adjust Parameters")
 
 	country = st.sidebar.selectbox("Country", countries)
-	country_df = health_grouped[country]
+	country_years = health_store.country_years(country)
 
-	max_year = country_df['Year'].max().item()
-	year = st.sidebar.select_slider("Year", options=list(np.sort(country_df['Year'].unique())), value=max_year)
+	max_year = country_years.max().item()
+	year = st.sidebar.select_slider("Year", options=list(country_years), value=max_year)
 	by_gender = st.sidebar.checkbox('View By Gender', value=False)
 
 	# # plot based on the country, hack for not displaying the column index
 	# st.dataframe(country_df.assign(hack='').set_index('hack'))
 
-	# plot the histogram base on country and year
-	row = country_df.loc[country_df['Year'] == year]
-
-	percentage_max = get_total_ymax(country_df, health_df)
-	age_ranges_overall = ['0-14', '15-19', '20-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69', '70-74', '75-79', '80 and above']
-	values_overall = []
-	for r in age_ranges_overall:
-		values_overall.append(row['Population ages {} (% of total population)'.format(r)].item())
-	curr_data_overall = pd.DataFrame({'Population Ages': age_ranges_overall, '% of Total Population': values_overall})
-
 	# the layered area graph
-	only_ten = get_only_ten_general(country_df, age_ranges_overall)
-	# highlight selector
-	keep_one = alt.selection_single(fields=['Year'], bind='legend', nearest=False, empty='all')
+	only_ten = chart_data.chart_data(age_table.sampled_counts(country), ['Idx', 'Population Ages', 'Year', 'Population'])
+	instrument.lap('filter')
 
-	area_graph = alt.Chart(only_ten).mark_area(opacity=0.4).encode(
-	    x=alt.X('Idx', title=None, axis=alt.Axis(ticks=True, grid=True, labels=False)),
-	    y=alt.Y('Population', stack=None),
-	    color=alt.Color("Year:N", scale=alt.Scale(scheme='lightmulti')),
-	    opacity=alt.condition(
-	    	keep_one,
-	    	alt.value(0.4),
-	    	alt.value(0)
-	    )
-	).add_selection(keep_one)
-
-
-	xaxis = alt.Chart(only_ten).mark_point().encode(
-	    x=alt.X('Population Ages', axis=alt.Axis(ticks=False, grid=False)),
-	    opacity=alt.value(0),
-	)
+	# the charts are built once, see spec_cache; later reruns only swap their data
+	def build_area_graph(only_ten):
+		# highlight selector
+		keep_one = alt.selection_single(fields=['Year'], bind='legend', nearest=False, empty='all')
+
+		area_graph = alt.Chart(only_ten).mark_area(opacity=0.4).encode(
+		    x=alt.X('Idx', title=None, axis=alt.Axis(ticks=True, grid=True, labels=False)),
+		    y=alt.Y('Population', stack=None),
+		    color=alt.Color("Year:N", scale=alt.Scale(scheme='lightmulti')),
+		    opacity=alt.condition(
+		    	keep_one,
+		    	alt.value(0.4),
+		    	alt.value(0)
+		    )
+		).add_selection(keep_one)
+
+
+		xaxis = alt.Chart(only_ten).mark_point().encode(
+		    x=alt.X('Population Ages', axis=alt.Axis(ticks=False, grid=False)),
+		    opacity=alt.value(0),
+		)
+		return alt.layer(xaxis, area_graph)
 
-	st.altair_chart(alt.layer(xaxis, area_graph), use_container_width=True)
+	instrument.altair_chart(spec_cache.chart('popu_area', build_area_graph, only_ten=only_ten), use_container_width=True)
 
 	st.markdown('''
 		The above graph visualizes the population age distribution of your selected country. 
@@ -249,61 +497,136 @@ def run_popu_dist():
 		5 sample years on the area graph.
 	''')
 
-	# get median
-	median = curr_data_overall['% of Total Population'].sum() / 2.0
-	p_agg = 0.0
-	for _, data_row in curr_data_overall.iterrows():
-		prev_p_agg = p_agg
-		p_agg += data_row['% of Total Population']
-		if p_agg >= median:
-			median_age_range = data_row['Population Ages']
-			break			
-
-	# highlight selector
-	highlight = alt.selection_single(on='mouseover', fields=['Population Ages'], nearest=False, clear="mouseout")
-
-	hist = alt.Chart(curr_data_overall).mark_bar().encode(
-	    y=alt.Y('% of Total Population',
-	    	scale=alt.Scale(domain=(0, percentage_max))),
-	    x='Population Ages',
-	    color=alt.condition(
-	        ~highlight,
-	        alt.Color('Population Ages:O', scale=alt.Scale(scheme='greens'), legend=None),
-	        alt.value('orange'),     # which sets the bar orange.
-	    ),
-	    tooltip=['Population Ages', '% of Total Population']
-	).add_selection(highlight).interactive()
-
-	hist_background = alt.Chart(curr_data_overall).mark_bar().encode(
-	    y=alt.Y('background_height:Q',
-	    	scale=alt.Scale(domain=(0, percentage_max)),
-	    	title='% of Total Population'),
-	    x=alt.X('Population Ages'),
-	    color=alt.condition(
-	        alt.datum['Population Ages'] == median_age_range,
-	        alt.value('lightgray'),
-	        alt.value('white')
-	    ),
-	    opacity=alt.condition(
-	        alt.datum['Population Ages'] == median_age_range,
-	        alt.value(0.2),
-	        alt.value(0.0)
-	    ),
-	).transform_calculate(
-		background_height = "100"
-	)
-
-	text = alt.Chart(curr_data_overall).mark_text(
-	    align='left',
-	    baseline='middle',
-	    dy=-10,
-	    dx=-15
-	).encode(
-		y=alt.Y('% of Total Population'),
-	    x='Population Ages',
-		text=alt.condition(alt.datum['Population Ages'] == median_age_range, alt.value('median'), alt.value(' '))
-	)
-	st.altair_chart(alt.layer(hist_background, hist, text), use_container_width=True)
+	# the charts of the selected year; the years next to it on the slider are
+	# computed ahead in the background (see prefetch.around), so stepping through
+	# them finds their charts cached. The table is an argument so the key holds its
+	# version, charts of older data finishing after a refresh are never served
+	@memo.memoize(maxsize=256)
+	def year_charts(age_table, country, year, by_gender):
+		# plot the histogram base on country and year
+		pos = age_table.position(country, year)
+
+		percentage_max = age_table.share_max
+		curr_data_overall = chart_data.chart_data(pd.DataFrame({'Population Ages': data_store.AGE_RANGES, '% of Total Population': age_table.shares[pos, 0]}),
+			['Population Ages', '% of Total Population'])
+
+		# get median
+		median_idx = age_table.median_bucket(pos)
+		median_age_range = data_store.AGE_RANGES[median_idx] if median_idx is not None else None
+		instrument.lap('filter')
+
+		def build_hist(curr_data_overall):
+			# highlight selector
+			highlight = alt.selection_single(on='mouseover', fields=['Population Ages'], nearest=False, clear="mouseout")
+
+			hist = alt.Chart(curr_data_overall).mark_bar().encode(
+			    y=alt.Y('% of Total Population',
+			    	scale=alt.Scale(domain=(0, percentage_max))),
+			    x='Population Ages',
+			    color=alt.condition(
+			        ~highlight,
+			        alt.Color('Population Ages:O', scale=alt.Scale(scheme='greens'), legend=None),
+			        alt.value('orange'),     # which sets the bar orange.
+			    ),
+			    tooltip=['Population Ages', '% of Total Population']
+			).add_selection(highlight).interactive()
+
+			hist_background = alt.Chart(curr_data_overall).mark_bar().encode(
+			    y=alt.Y('background_height:Q',
+			    	scale=alt.Scale(domain=(0, percentage_max)),
+			    	title='% of Total Population'),
+			    x=alt.X('Population Ages'),
+			    color=alt.condition(
+			        alt.datum['Population Ages'] == median_age_range,
+			        alt.value('lightgray'),
+			        alt.value('white')
+			    ),
+			    opacity=alt.condition(
+			        alt.datum['Population Ages'] == median_age_range,
+			        alt.value(0.2),
+			        alt.value(0.0)
+			    ),
+			).transform_calculate(
+				background_height = "100"
+			)
+
+			text = alt.Chart(curr_data_overall).mark_text(
+			    align='left',
+			    baseline='middle',
+			    dy=-10,
+			    dx=-15
+			).encode(
+				y=alt.Y('% of Total Population'),
+			    x='Population Ages',
+				text=alt.condition(alt.datum['Population Ages'] == median_age_range, alt.value('median'), alt.value(' '))
+			)
+			return alt.layer(hist_background, hist, text)
+
+		hist = spec_cache.chart(('popu_hist', percentage_max, median_age_range), build_hist,
+			curr_data_overall=curr_data_overall)
+		pyramid = None
+		if by_gender:
+			# oldest first, there is no 0-14 bucket by gender
+			age_ranges = data_store.AGE_RANGES[:0:-1]
+			male_values = age_table.shares[pos, 1, :0:-1]
+			female_values = age_table.shares[pos, 2, :0:-1]
+			curr_data = chart_data.chart_data(pd.DataFrame({'Population ages': age_ranges, '% of Male Population': male_values, '% of Female Population': female_values}),
+				['Population ages', '% of Male Population', '% of Female Population'])
+		
+			# write current data
+			#st.dataframe(curr_data.iloc[::-1].assign(hack='').set_index('hack'))
+
+			maxx = curr_data['% of Male Population'].max()
+			if curr_data['% of Female Population'].max() > maxx:
+				maxx = curr_data['% of Female Population'].max()
+			instrument.lap('filter')
+
+			def build_bihist(curr_data):
+				base2 = alt.Chart(curr_data).properties(width=300)
+				# highlight selector
+				highlight2 = alt.selection_single(on='mouseover', fields=['Population ages'], nearest=False, clear="mouseout")
+
+				left = base2.encode(
+				    y=alt.Y('Population ages:O', axis=None, sort=alt.EncodingSortField(order='ascending')),
+				    x=alt.X('% of Female Population',
+				            title='% of Female Population',
+				            sort=alt.SortOrder('descending'),
+				            scale=alt.Scale(domain=(0, maxx))),
+				    color=alt.condition(
+				        ~highlight2,
+				        alt.Color('Population ages:O', scale=alt.Scale(scheme='redpurple'), legend=None),
+				        alt.value('orange'),     # which sets the bar orange.
+				    ),
+				    tooltip=['Population ages', '% of Female Population']
+				).mark_bar().properties(title='Female').add_selection(highlight2)
+
+				middle = base2.encode(
+				    y=alt.Y('Population ages:O', axis=None, sort=alt.EncodingSortField(order='ascending')),
+				    text=alt.Text('Population ages'),
+				).mark_text().properties(width=40)
+
+				right = base2.encode(
+				    y=alt.Y('Population ages:O', axis=None, sort=alt.EncodingSortField(order='ascending')),
+				    x=alt.X('% of Male Population',
+				            title='% of Male Population',
+				            sort=alt.SortOrder('ascending'),
+				            scale=alt.Scale(domain=(0, maxx))),
+				    color=alt.condition(
+				        ~highlight2,
+				        alt.Color('Population ages:O',scale=alt.Scale(scheme='blues'), legend=None),
+				        alt.value('orange'),     # which sets the bar orange.
+				    ),
+				    tooltip=['Population ages', '% of Male Population']
+				).mark_bar().properties(title='Male').add_selection(highlight2)
+
+				bihist=alt.concat(left, middle, right, spacing=2).resolve_scale(color='independent')
+				return bihist
+
+			pyramid = spec_cache.chart(('popu_pyramid', maxx), build_bihist, curr_data=curr_data)
+		return hist, pyramid
+
+	hist, pyramid = year_charts(age_table, country, year, by_gender)
+	instrument.altair_chart(hist, use_container_width=True)
 
 	st.markdown('''
 		This is a bar chart displaying the detailed population distribution of your selected country in one specific year.
@@ -324,61 +647,8 @@ def run_popu_dist():
 		'View by Gender' **checkbox** on the side bar, you can view the population distribution pyramid graph.
 	''')
 
-	if by_gender:
-		age_ranges = ['80 and above', '75-79', '70-74', '65-69', '60-64', '55-59', '50-54', '45-49', '40-44', '35-39', '30-34', '25-29', '20-24', '15-19']
-		male_values = []
-		female_values = []
-		for r in age_ranges:
-			male_values.append(row['Population ages {}, male (% of male population)'.format(r)].item())
-			female_values.append(row['Population ages {}, female (% of female population)'.format(r)].item())
-		curr_data = pd.DataFrame({'Population ages': age_ranges, '% of Male Population': male_values, '% of Female Population': female_values})
-		
-		# write current data
-		#st.dataframe(curr_data.iloc[::-1].assign(hack='').set_index('hack'))
-
-		maxx = curr_data['% of Male Population'].max()
-		if curr_data['% of Female Population'].max().item() > maxx:
-			maxx = curr_data['% of Female Population'].max()
-
-		base2 = alt.Chart(curr_data).properties(width=300)
-		# highlight selector
-		highlight2 = alt.selection_single(on='mouseover', fields=['Population ages'], nearest=False, clear="mouseout")
-
-		left = base2.encode(
-		    y=alt.Y('Population ages:O', axis=None, sort=alt.EncodingSortField(order='ascending')),
-		    x=alt.X('% of Female Population',
-		            title='% of Female Population',
-		            sort=alt.SortOrder('descending'),
-		            scale=alt.Scale(domain=(0, maxx))),
-		    color=alt.condition(
-		        ~highlight2,
-		        alt.Color('Population ages:O', scale=alt.Scale(scheme='redpurple'), legend=None),
-		        alt.value('orange'),     # which sets the bar orange.
-		    ),
-		    tooltip=['Population ages', '% of Female Population']
-		).mark_bar().properties(title='Female').add_selection(highlight2)
-
-		middle = base2.encode(
-		    y=alt.Y('Population ages:O', axis=None, sort=alt.EncodingSortField(order='ascending')),
-		    text=alt.Text('Population ages'),
-		).mark_text().properties(width=40)
-
-		right = base2.encode(
-		    y=alt.Y('Population ages:O', axis=None, sort=alt.EncodingSortField(order='ascending')),
-		    x=alt.X('% of Male Population',
-		            title='% of Male Population',
-		            sort=alt.SortOrder('ascending'),
-		            scale=alt.Scale(domain=(0, maxx))),
-		    color=alt.condition(
-		        ~highlight2,
-		        alt.Color('Population ages:O',scale=alt.Scale(scheme='blues'), legend=None),
-		        alt.value('orange'),     # which sets the bar orange.
-		    ),
-		    tooltip=['Population ages', '% of Male Population']
-		).mark_bar().properties(title='Male').add_selection(highlight2)
-
-		bihist=alt.concat(left, middle, right, spacing=2).resolve_scale(color='independent')
-		st.altair_chart(bihist, use_container_width=True)
+	if pyramid is not None:
+		instrument.altair_chart(pyramid, use_container_width=True)
 
 		st.markdown('''
 			This is a classic age structure pyramid graph. The left side of the graph is the age population 
@@ -387,6 +657,9 @@ def run_popu_dist():
 			This bar and the bar of the same age group from the other gender will also be highlighted orange.
 		''')
 
+	prefetch.around('run_popu_dist', (country, by_gender), country_years, year,
+		lambda neighbour: year_charts(age_table, country, neighbour, by_gender))
+
 	st.markdown('''
 		
 		### References
@@ -405,6 +678,7 @@ def run_popu_dist():
 	''')	
 
 
+@instrument.view
 def run_var_relationship_per_country():
 	st.markdown('''
 	## How is an economy indicator associated with a health indicator for a specific country?
@@ -433,48 +707,79 @@ def run_var_relationship_per_country():
 	Please note that the original data has many missing entries. When there is no data for either indicator in the selected pair for the selected country, 
 	we cannot generate a visualization for you, as indicated by "Data Not Available." Please try another pair of indicators.
 	''')
-	df, countries, econ_indicators, health_indicators = load_other_data()
-	other_data_df = df.copy()
-	other_data_df['Year'] = pd.to_datetime(other_data_df['Year'], format='%Y')
+	_, countries, econ_indicators, health_indicators = load_other_data()
+	other_store = load_other_store()
+	availability = load_availability(other_store)
+	instrument.lap('load')
 	st.sidebar.header("Adjust Parameters")
 
 	country = st.sidebar.selectbox("Country", countries)
-	country_df = other_data_df[other_data_df["Country Name"] == country]
+	country_df = other_store.country(country, dated=True)
 
 	econ_indicator = st.sidebar.selectbox("Economy Indicator", econ_indicators, index = 1)
 	health_indicator = st.sidebar.selectbox("Health Indicator", health_indicators, index = 2)
-	bi_var_df = country_df[["Year", econ_indicator, health_indicator]]
+	bi_var_df = chart_data.chart_data(country_df, ["Year", econ_indicator, health_indicator])
+	instrument.lap('filter')
 
-	if bi_var_df.dropna().empty:
+	if not availability.overlaps(country, [econ_indicator, health_indicator]):
 		st.write("Data Not Available")
 	else:
-		nearest1 = alt.selection(type='single', nearest=True, on='mouseover',
-								fields=['Year'], empty='none')
-		nearest2 = alt.selection(type='single', nearest=True, on='mouseover',
-								fields=['x'], empty='none')
-		base = alt.Chart(bi_var_df).encode(
-			alt.X('Year:T', axis=alt.Axis(title='Year', format=("%Y")))
-		)
-		line1 = base.mark_line(color='#5276A7').encode(
-			alt.Y(econ_indicator,
-				  axis=alt.Axis(title=econ_indicator, titleColor='#5276A7')),
-				  tooltip=[alt.Tooltip(econ_indicator, title=econ_indicator)]
-		).add_selection(nearest1).interactive()
-		line2 = base.mark_line(color='#57A44C').encode(
-			alt.Y(health_indicator,
-				  axis=alt.Axis(title=health_indicator, titleColor='#57A44C')),
-			      tooltip=[alt.Tooltip(health_indicator, title=health_indicator)]
-		).add_selection(nearest2).interactive()
-		line_plot = alt.layer(line1, line2).resolve_scale(
-			y='independent'
-		)
-		st.altair_chart(line_plot, use_container_width=True)
+		def build_line_plot(bi_var_df):
+			nearest1 = alt.selection(type='single', nearest=True, on='mouseover',
+									fields=['Year'], empty='none')
+			nearest2 = alt.selection(type='single', nearest=True, on='mouseover',
+									fields=['x'], empty='none')
+			base = alt.Chart(bi_var_df).encode(
+				alt.X('Year:T', axis=alt.Axis(title='Year', format=("%Y")))
+			)
+			line1 = base.mark_line(color='#5276A7').encode(
+				alt.Y(econ_indicator,
+					  axis=alt.Axis(title=econ_indicator, titleColor='#5276A7')),
+					  tooltip=[alt.Tooltip(econ_indicator, title=econ_indicator)]
+			).add_selection(nearest1).interactive()
+			line2 = base.mark_line(color='#57A44C').encode(
+				alt.Y(health_indicator,
+					  axis=alt.Axis(title=health_indicator, titleColor='#57A44C')),
+				      tooltip=[alt.Tooltip(health_indicator, title=health_indicator)]
+			).add_selection(nearest2).interactive()
+			line_plot = alt.layer(line1, line2).resolve_scale(
+				y='independent'
+			)
+			return line_plot
+
+		instrument.altair_chart(spec_cache.chart(('country_lines', econ_indicator, health_indicator), build_line_plot, bi_var_df=bi_var_df),
+			use_container_width=True)
+
+	st.markdown('''
+	### Strongest Relationships in {}
+
+	Rather than trying every pair, here are the pairs of indicators which moved together most closely in this country over the years,
+	strongest first by their Pearson correlation (Spearman's rank correlation is next to it). A lag of 2 compares the economy indicator 
+	in a year with the health indicator two years later. Pairs with less than {} years of data for both are left out.
+	'''.format(country, correlation.MIN_PAIRS))
+	strongest_relationships(other_store, 'time', country)
+	st.markdown('''
+	### Countries Like {}
+
+	The countries whose economy and health indicators went through the most similar values over the same years,
+	most similar first. Every indicator is put on a common scale, and the distance is the typical gap between the two
+	countries on it, in standard deviations, averaged over the indicators both have at least {} years of data for.
+	'''.format(country, similarity.MIN_OVERLAP))
+	similar = load_similar_countries(other_store, country)
+	instrument.lap('load')
+	if similar.empty:
+		st.write("Data Not Available")
+	else:
+		st.dataframe(similar)
+		st.button("Compare Their Life Expectancy", on_click=compare_countries,
+			args=([country] + list(similar['Similar Country'][:5]),))
 	st.markdown('''
 				### References
 				[1]
 				Austin B. Frakt (2018) - "How the Economy Affects Health". JAMA. 319(12):1187–1188. doi:10.1001/jama.2018.1739
 			''')
 
+@instrument.view
 def run_one_var_across_region():
 	st.markdown('''
 	## What's the world-wide trend of a particular indicator?
@@ -492,50 +797,130 @@ def run_one_var_across_region():
 	a world map whose coloring corresponds to magnitude of the indicator. To check out the indicator value for a particular country, move your mouse over the approximate location of the country on the map.
 	Slide over time to check out how the world-wide trend changed temporally!
 	''')
-	countries = alt.topo_feature(WORLD_MAP_URL, 'countries')
-	other_data_df, _, econ_indicators, health_indicators = load_other_data()
+	_, _, econ_indicators, health_indicators = load_other_data()
+	map_slices = load_map_slices()
+	instrument.lap('load')
 	st.sidebar.header("Adjust Parameters")
 
-	indicator = st.sidebar.selectbox("Health / Economy Indicator", list(econ_indicators) + list(health_indicators))
-	uni_var_df = other_data_df[["Country Name", "Year", indicator, 'id', 'Latitude (average)', 'Longitude (average)']]
+	# bundled map detail levels; lower ones are lighter for slow connections
+	map_details = [d for d in MAP_DETAILS if world_map_url(MAP_DETAILS[d])]
+	map_url = WORLD_MAP_URL
+	if map_details:
+		map_detail = st.sidebar.selectbox("Map Detail", map_details)
+		map_url = world_map_url(MAP_DETAILS[map_detail])
+
+	indicator = st.sidebar.selectbox("Health / Economy Indicator", list(econ_indicators) + list(health_indicators) + age_indicators())
+	years = map_slices.years[indicator]
+
+	# every year in one map, stepped through in the browser without reruns
+	play = bool(years) and st.sidebar.checkbox("Play Over Time", value=False)
+	year = st.sidebar.select_slider("Year", options=years, value=years[-1]) if years and not play else None
+
+	# the map of one year, None without data; the years next to it on the slider
+	# are computed ahead like in run_popu_dist
+	@memo.memoize(maxsize=256)
+	def year_map(map_slices, indicator, map_url, year):
+		uni_var_one_year_df = chart_data.chart_data(map_slices.get(indicator, year), MAP_COLUMNS + [indicator])
+		instrument.lap('filter')
+		if uni_var_one_year_df.empty:
+			return None
+		countries = alt.topo_feature(map_url, 'countries')
+
+		def build_map(uni_var_one_year_df):
+			map = alt.Chart(countries).mark_geoshape().encode(
+				color=alt.Color(indicator+':Q',
+					scale=alt.Scale(scheme="yellowgreenblue"),
+					legend=alt.Legend(orient='top', titleLimit=800, titleOrient='left'))
+			).transform_lookup(
+				lookup='id',
+				from_=alt.LookupData(uni_var_one_year_df, 'id', [indicator])
+			).project(
+				'equirectangular'
+			)
 
-	no_na_df = uni_var_df.dropna()
-	max_year = no_na_df["Year"].max().item()
-	year = st.sidebar.select_slider("Year", options=list(np.sort(no_na_df['Year'].unique())), value=max_year)
-	uni_var_one_year_df = uni_var_df[uni_var_df["Year"] == year]
+			hover = alt.selection(type='single', on='mouseover', nearest=True,
+								  fields=['Longitude (average)', 'Latitude (average):Q'])
+			points = alt.Chart(uni_var_one_year_df).mark_circle(
+				point = 'transparent'
+			).encode(
+				longitude='Longitude (average):Q',
+				latitude='Latitude (average):Q',
+				opacity=alt.value(0),
+				tooltip=['Country Name:N', indicator+':Q']
+			).add_selection(hover)
+			map = (map + points).properties(height=500)
+			return map
+
+		return spec_cache.chart(('map', indicator, map_url), build_map, uni_var_one_year_df=uni_var_one_year_df)
+
+	# the map of every year with a year slider of its own, the colour scale spans
+	# all the years so it stays put while they play. The values of every year
+	# are sent apart from the names and positions of the countries, which
+	# would repeat in every year
+	@memo.memoize(maxsize=32)
+	def play_map(indicator, map_url):
+		all_years_df = map_slices.all_years(indicator)
+		values = chart_data.chart_data(all_years_df, ['id', 'Year', indicator])
+		places = chart_data.chart_data(all_years_df.drop_duplicates('id'), MAP_COLUMNS)
+		instrument.lap('filter')
+		low = values[indicator].min().item()
+		high = values[indicator].max().item()
+		countries = alt.topo_feature(map_url, 'countries')
+
+		def build_play_map(values, places):
+			play_year = alt.selection_single(name='year', fields=['Year'], init={'Year': years[-1]},
+				bind=alt.binding_range(min=years[0], max=years[-1], step=1, name='Year '))
+			# countries without a value in the year shown stay grey
+			background = alt.Chart(countries).mark_geoshape(fill='lightgray').project('equirectangular')
+			map = alt.Chart(values).mark_geoshape().encode(
+				shape='geo:G',
+				color=alt.Color(indicator+':Q',
+					scale=alt.Scale(scheme="yellowgreenblue", domain=(low, high)),
+					legend=alt.Legend(orient='top', titleLimit=800, titleOrient='left'))
+			).transform_filter(
+				play_year
+			).transform_lookup(
+				lookup='id',
+				from_=alt.LookupData(countries, 'id'),
+				as_='geo'
+			).project(
+				'equirectangular'
+			)
+
+			hover = alt.selection(type='single', on='mouseover', nearest=True,
+								  fields=['Longitude (average)', 'Latitude (average):Q'])
+			points = alt.Chart(values).mark_circle(
+				point = 'transparent'
+			).encode(
+				longitude='Longitude (average):Q',
+				latitude='Latitude (average):Q',
+				opacity=alt.value(0),
+				tooltip=['Country Name:N', 'Year:O', indicator+':Q']
+			).transform_filter(
+				play_year
+			).transform_lookup(
+				lookup='id',
+				from_=alt.LookupData(places, 'id', MAP_COLUMNS[:1] + MAP_COLUMNS[2:])
+			).add_selection(hover, play_year)
+			return (background + map + points).properties(height=500)
 
-	if uni_var_one_year_df.dropna().empty:
+		return spec_cache.chart(('play_map', indicator, map_url, low, high), build_play_map, values=values, places=places)
+
+	map_spec = play_map(indicator, map_url) if play else year_map(map_slices, indicator, map_url, year)
+	if map_spec is None:
 		st.write("Data Not Available")
 	else:
-		map = alt.Chart(countries).mark_geoshape().encode(
-			color=alt.Color(indicator+':Q',
-				scale=alt.Scale(scheme="yellowgreenblue"),
-				legend=alt.Legend(orient='top', titleLimit=800, titleOrient='left'))
-		).transform_lookup(
-			lookup='id',
-			from_=alt.LookupData(uni_var_one_year_df, 'id', [indicator])
-		).project(
-			'equirectangular'
-		)
-
-		hover = alt.selection(type='single', on='mouseover', nearest=True,
-							  fields=['Longitude (average)', 'Latitude (average):Q'])
-		points = alt.Chart(uni_var_one_year_df).mark_circle(
-			point = 'transparent'
-		).encode(
-			longitude='Longitude (average):Q',
-			latitude='Latitude (average):Q',
-			opacity=alt.value(0),
-			tooltip=['Country Name:N', indicator+':Q']
-		).add_selection(hover)
-		map = (map + points).properties(height=500)
-		st.altair_chart(map, use_container_width=True)
+		instrument.altair_chart(map_spec, use_container_width=True)
+		if not play:
+			prefetch.around('run_one_var_across_region', (indicator, map_url), years, year,
+				lambda neighbour: year_map(map_slices, indicator, map_url, neighbour))
 	st.markdown('''
 	### References
 	
 	[1] Athanasios Vamvakidis (1998) - "Regional Integration and Economic Growth". The World Bank Economic Review, Volume 12, Issue 2, May 1998, Pages 251–270, https://doi.org/10.1093/wber/12.2.251''')
 
 
+@instrument.view
 def run_trend_over_time():
 	st.markdown('''
 		## How is life expectancy associated with health indicators and economics indicators?
@@ -555,9 +940,9 @@ def run_trend_over_time():
 		Once you have selected one or more countries to focus on, you can choose from the **drop down menu** in the sidebar an additional indicator to explore its relationship with life expectancy over time, while
 		comparing among multiple countries.
 	''')
-	data_cached, countries = load_merge_data()
-	data = data_cached.copy()
-	data['Year'] = pd.to_datetime(data['Year'], format='%Y')
+	_, countries = load_merge_data()
+	merge_store = load_merge_store()
+	instrument.lap('load')
 
 	# drop box to select one variable to view
 	st.sidebar.header("Adjust Parameters")
@@ -569,69 +954,89 @@ def run_trend_over_time():
        'Unemployment, total (% of total labor force)',
        'Gini',]
 
-	factor = st.sidebar.selectbox("Additional Factors", factors)
+	factor = st.sidebar.selectbox("Additional Factors", factors + age_indicators())
 
-	selected_countries = st.sidebar.multiselect('Select Countries to Compare', countries)
+	# countries, or the precomputed means of regions, income groups or the world
+	# the groups are weighted by the population of the health data
+	levels = rollup.levels(load_membership()[0]) if load_age_summary()[0] is not None else []
+	compare = st.sidebar.selectbox("Compare", ['Countries'] + levels, key='compare')
+	if compare == 'Countries':
+		selected_countries = st.sidebar.multiselect('Select Countries to Compare', countries, key='compare_countries')
+	else:
+		group_names = rollup.group_names(load_rollups(merge_store), compare)
+		instrument.lap('load')
+		selected_countries = st.sidebar.multiselect('Select Groups to Compare', group_names, default=group_names)
 
 	# plot factor countries over time
-	if selected_countries:
+	if selected_countries and compare != 'Countries':
+		curr_df = load_rollup_series(merge_store, compare, tuple(selected_countries), factor)
+		instrument.lap('load')
+	elif selected_countries:
 
-		curr_df = keep_only_selected_countries(data, selected_countries)
+		curr_df = merge_store.select_countries(selected_countries, dated=True)
 
-		curr_df = dropna_by_feature(curr_df, [factor, 'Life expectancy at birth, total (years)'])
+		curr_df = curr_df.dropna(how='any', subset=[factor, 'Life expectancy at birth, total (years)'])
+		# one dataset of the encoded columns, shared by all layers below
+		curr_df = chart_data.chart_data(curr_df, ['Country Name', 'Year', factor, 'Life expectancy at birth, total (years)'])
+		instrument.lap('filter')
 
-		line_p = alt.Chart(curr_df).mark_line().encode(
-		    x=alt.X('Year:T', axis = alt.Axis(title = 'Year', format = ("%Y"))),
-		    color='Country Name'
-		)
-		upper = line_p.encode(y=str(factor))
-		lower = line_p.encode(y='Life expectancy at birth, total (years)')
-
-		# Create a selection that chooses the nearest point & selects based on x-value
-		nearest = alt.selection(type='single', nearest=True, on='mouseover',
-                        		fields=['Year'], empty='none')
-		idx = 0
-		plots = [upper, lower]
-		result_plots = []
-		for line in plots:
-
-			# Transparent selectors across the chart. This is what tells us
-			# the x-value of the cursor
-			selectors = alt.Chart(curr_df).mark_point().encode(
-			    x='Year',
-			    opacity=alt.value(0),
-			)
-			if idx == 0:
-				selectors = selectors.add_selection(nearest)
+	if selected_countries:
 
-			# Draw a rule at the location of the selection
-			rules = alt.Chart(curr_df).mark_rule(color='darkgray').encode(
-			    x='Year',
-			).transform_filter(
-			    nearest
-			)
-			# Draw points on the line, and highlight based on selection
-			points = line.mark_point().encode(
-			    opacity=alt.condition(nearest, alt.value(1), alt.value(0))
+		def build_result_plot(curr_df):
+			line_p = alt.Chart(curr_df).mark_line().encode(
+			    x=alt.X('Year:T', axis = alt.Axis(title = 'Year', format = ("%Y"))),
+			    color='Country Name'
 			)
-			if idx == 0:
-				# Draw text labels near the points, and highlight based on selection
-				text = line.mark_text(align='left', dx=5, dy=-5).encode(
-				    text=alt.condition(nearest, str(factor), alt.value(' '))
+			upper = line_p.encode(y=str(factor))
+			lower = line_p.encode(y='Life expectancy at birth, total (years)')
+
+			# Create a selection that chooses the nearest point & selects based on x-value
+			nearest = alt.selection(type='single', nearest=True, on='mouseover',
+	                        		fields=['Year'], empty='none')
+			idx = 0
+			plots = [upper, lower]
+			result_plots = []
+			for line in plots:
+
+				# Transparent selectors across the chart. This is what tells us
+				# the x-value of the cursor
+				selectors = alt.Chart(curr_df).mark_point().encode(
+				    x='Year',
+				    opacity=alt.value(0),
+				)
+				if idx == 0:
+					selectors = selectors.add_selection(nearest)
+
+				# Draw a rule at the location of the selection
+				rules = alt.Chart(curr_df).mark_rule(color='darkgray').encode(
+				    x='Year',
+				).transform_filter(
+				    nearest
 				)
-			else:
-				# Draw text labels near the points, and highlight based on selection
-				text = line.mark_text(align='left', dx=10, dy=-10).encode(
-				    text=alt.condition(nearest, 'Life expectancy at birth, total (years)', alt.value(' '))
-				)	
-			if idx == 0:
-				# Put the five layers into a chart and bind the data
-				result_plots.append(alt.layer(line, selectors, points, rules, text))
-			else:
-				result_plots.append(alt.layer(line, selectors, points, rules, text).properties(height=200))	
-			idx += 1
-		result_plot = alt.vconcat(result_plots[0], result_plots[1]) 
-		st.altair_chart(result_plot, use_container_width=True)
+				# Draw points on the line, and highlight based on selection
+				points = line.mark_point().encode(
+				    opacity=alt.condition(nearest, alt.value(1), alt.value(0))
+				)
+				if idx == 0:
+					# Draw text labels near the points, and highlight based on selection
+					text = line.mark_text(align='left', dx=5, dy=-5).encode(
+					    text=alt.condition(nearest, str(factor), alt.value(' '))
+					)
+				else:
+					# Draw text labels near the points, and highlight based on selection
+					text = line.mark_text(align='left', dx=10, dy=-10).encode(
+					    text=alt.condition(nearest, 'Life expectancy at birth, total (years)', alt.value(' '))
+					)	
+				if idx == 0:
+					# Put the five layers into a chart and bind the data
+					result_plots.append(alt.layer(line, selectors, points, rules, text))
+				else:
+					result_plots.append(alt.layer(line, selectors, points, rules, text).properties(height=200))	
+				idx += 1
+			result_plot = alt.vconcat(result_plots[0], result_plots[1]) 
+			return result_plot
+
+		instrument.altair_chart(spec_cache.chart(('trend_countries', factor), build_result_plot, curr_df=curr_df), use_container_width=True)
 		st.markdown('''
 			The above graph consists of two line charts. The upper one displays a line chart of your selected 
 			indicator for the selected countries over time. The lower chart, on the same time scale, displays 
@@ -645,30 +1050,86 @@ def run_trend_over_time():
 			points to, and the corresponding data points will be exaggrated with the exact y values to the right of the 
 			data point. The values are printed in the same color as its corresponding line.
 		''')
+		if compare != 'Countries':
+			st.markdown('''
+				Comparing groups instead of countries, each line is the mean of the countries of a group, weighted by
+				their population. The table below shows how life expectancy spreads over the people of each group:
+				q10 is the life expectancy which 10% of them fall below, q50 the median, and so on.
+			''')
+			st.dataframe(load_rollup_spread(merge_store, compare, tuple(selected_countries), 'Life expectancy at birth, total (years)'))
 
 	else:
-		country_filter = st.radio('', ('All', 'Top 5 as of 2017', 'Bottom 5 as of 2017'))
+		country_filter = st.radio('', ('All', 'Top Ranked', 'Bottom Ranked'))
+		line_detail = 'Full'
 		if country_filter == 'All':
+			line_detail = st.sidebar.select_slider("Line Detail", options=LINE_DETAILS, value='Simplified')
 			countries_keep = countries
-		elif country_filter == 'Top 5 as of 2017':
-			countries_keep = data[data['Year'] == pd.to_datetime('2017', format='%Y')].sort_values('Life expectancy at birth, total (years)',ascending = False).head(5)['Country Name']
 		else:
-			countries_keep = data[data['Year'] == pd.to_datetime('2017', format='%Y')].sort_values('Life expectancy at birth, total (years)').head(5)['Country Name']
-
-		data = keep_only_selected_countries(data, countries_keep)
-		# always plot the life expectancy
-		life_exp = alt.Chart(data).mark_line(size=4).encode(
-			x=alt.X('Year:T', 
+			# by any indicator in any year, the ranking is sorted once per dataset
+			ranking = load_ranking(merge_store)
+			instrument.lap('load')
+			rank_by = st.sidebar.selectbox("Rank By", ranking.indicators,
+				index=ranking.indicators.index('Life expectancy at birth, total (years)'))
+			rank_years = ranking.years(rank_by)
+			rank_year = st.sidebar.select_slider("As of Year", options=list(rank_years), value=rank_years[-1].item())
+			rank_count = st.sidebar.select_slider("Number of Countries", options=list(range(1, 21)), value=5)
+			rank = ranking.top if country_filter == 'Top Ranked' else ranking.bottom
+			countries_keep = rank(rank_by, rank_year, rank_count)
+
+		# the data of the layers below, by the name they are built with
+		datasets = {}
+		if line_detail != 'Full':
+			datasets['band'] = load_life_expectancy_band()
+			instrument.lap('load')
+		if line_detail == 'Simplified':
+			datasets['data'] = load_life_expectancy_lines()
+			instrument.lap('load')
+		elif line_detail == 'Full':
+			datasets['data'] = chart_data.chart_data(merge_store.select_countries(countries_keep, dated=True),
+				['Country Name', 'Year', 'Life expectancy at birth, total (years)'])
+			instrument.lap('filter')
+
+		def build_life_exp(band=None, data=None):
+			x = alt.X('Year:T', 
 					 scale=alt.Scale(domain=(
 					 	pd.to_datetime('1960', format='%Y'),
-					 	pd.to_datetime('2017', format='%Y')
+					 	pd.to_datetime(str(last_year()), format='%Y')
 					 )),
-					 axis = alt.Axis(title = 'Year', format = ("%Y"))),
-		    y=alt.Y('Life expectancy at birth, total (years)', scale=alt.Scale(domain=(0, 90))),
-		    color='Country Name',
-		    tooltip=['Country Name']
-		)
-		st.altair_chart(life_exp.properties(height=450), use_container_width=True)
+					 axis = alt.Axis(title = 'Year', format = ("%Y")))
+			y_scale = alt.Scale(domain=(0, 90))
+			layers = []
+			if line_detail != 'Full':
+				# the spread of all countries as background: 10-90% and 25-75% of countries, and the median
+				band_base = alt.Chart(band).encode(x=x)
+				layers += [
+					band_base.mark_area(opacity=0.15, color='steelblue').encode(
+						y=alt.Y('q10:Q', scale=y_scale, title='Life expectancy at birth, total (years)'), y2='q90:Q'),
+					band_base.mark_area(opacity=0.25, color='steelblue').encode(y=alt.Y('q25:Q', scale=y_scale), y2='q75:Q'),
+					band_base.mark_line(color='black', strokeDash=[4, 2]).encode(y=alt.Y('Median:Q', scale=y_scale),
+						tooltip=[alt.Tooltip('Year:T', format='%Y'), 'Median:Q']),
+				]
+			if line_detail == 'Simplified':
+				hover = alt.selection_single(on='mouseover', fields=['Country Name'], empty='none', clear='mouseout')
+				layers.append(alt.Chart(data).mark_line().encode(
+					x=x,
+					y=alt.Y('Life expectancy at birth, total (years)', scale=y_scale),
+					color=alt.Color('Country Name', legend=None),
+					size=alt.condition(hover, alt.value(4), alt.value(1)),
+					opacity=alt.condition(hover, alt.value(1), alt.value(0.4)),
+					tooltip=['Country Name']
+				).add_selection(hover))
+			elif line_detail == 'Full':
+				# always plot the life expectancy
+				layers.append(alt.Chart(data).mark_line(size=4).encode(
+					x=x,
+				    y=alt.Y('Life expectancy at birth, total (years)', scale=y_scale),
+				    color='Country Name',
+				    tooltip=['Country Name']
+				))
+			life_exp = layers[0] if len(layers) == 1 else alt.layer(*layers)
+			return life_exp.properties(height=450)
+
+		instrument.altair_chart(spec_cache.chart(('trend_all', line_detail, last_year()), build_life_exp, **datasets), use_container_width=True)
 		st.markdown('''
 			The above is a line graph of life expectancy at birth over time, where each line is a different country.
 			Most of the lines are mangled together as there are so many countries in the world. Instead of looking at the 
@@ -678,10 +1139,16 @@ def run_trend_over_time():
 			If you find a particular line especially interesting, you will be able to see the name of the country 
 			corresponding to the line by moving your mouse over it.
 
+			With 'All', the shaded band shows where the middle 50% (darker) and 80% (lighter) of countries lie in each year,
+			and the dashed line is the median country. To keep the graph responsive, each country's line is simplified:
+			years where the line would barely bend are left out, so it is never off by more than a quarter of a year.
+			Use the **Line Detail** slider in the side bar to show only the band, or every year of every country.
+			To see the exact data of a few countries, select them in the multi-selection box.
+
 			We have provided two filter options to help you narrow down your exploration scope. The default 'All' will
-			show all countries on the graph; 'Top 5 as of 2017' will only keep 5 countries or regions with highest
-			life expectancy in 2017; similarly, 'Bottom 5 as of 2017' will only keep 5 countries or regions with least
-			life expectancy in 2017.
+			show all countries on the graph; 'Top Ranked' will only keep the countries or regions with highest
+			life expectancy in the latest year, 5 of them unless you pick another number; similarly, 'Bottom Ranked' will only keep
+			those with least life expectancy. In the side bar you can rank them by another indicator, or as of another year.
 		''')
 
 	st.markdown('''
@@ -692,13 +1159,9 @@ def run_trend_over_time():
 		Circulation, 138(4), 345-355. doi:10.1161/circulationaha.117.032047
 	''')
 
+@instrument.view
 def run_relationship_per_year_all_countries():
 
-	@st.cache
-	def get_by_year(df, year):
-		return df[df['Year'] == year]
-
-
 	st.markdown('''
 		## How is an economy indicator associated with a health indicator among different countries?
 		
@@ -726,7 +1189,9 @@ def run_relationship_per_year_all_countries():
 
 	st.sidebar.header("Adjust Parameters")
 
-	data, countries = load_merge_data()
+	merge_store = load_merge_store()
+	availability = load_availability(merge_store)
+	instrument.lap('load')
 
 	econ_factors = [
 			       'GDP per capita (current US$)',
@@ -741,64 +1206,94 @@ def run_relationship_per_year_all_countries():
 	e_factor = st.sidebar.radio("Economics Factor", (econ_factors))
 	h_factor = st.sidebar.radio("Health Factor", (health_factors))
 
-	curr_data = dropna_by_feature(data, [e_factor, h_factor])
-
-	max_year = curr_data['Year'].max().item()
-	year = st.sidebar.select_slider("Year", options=list(np.sort(curr_data['Year'].unique())), value=max_year)
-
-	curr_data = get_by_year(curr_data, year)
-	#st.dataframe(curr_data[['Country Name', e_factor, h_factor]].assign(hack='').set_index('hack'))
-
-	# plot a auxiliary life expectancy graph below
-
-	# get max and min y
-	max_life = curr_data['Life expectancy at birth, total (years)'].max().item()
-	min_life = curr_data['Life expectancy at birth, total (years)'].min().item()
-
-	# double click to clear brush
-	brush = alt.selection_interval(encodings=['x'])
-	highlight = alt.selection_single(encodings=['color'], on='mouseover', nearest=False, clear="mouseout")
-
-	stripplot = alt.Chart(curr_data).mark_circle(size=40).encode(
-		x=alt.X('Life expectancy at birth, total (years):Q', 
-			scale=alt.Scale(domain=(min_life, max_life))
-		),
-		y=alt.Y('jitter:Q',
-	        title=None,
-	        axis=alt.Axis(values=[0], ticks=False, grid=False, labels=False),
-	        scale=alt.Scale(),
-	    ),
-		color=alt.Color('Country Name', legend=None),
-		opacity=alt.condition(
-			highlight,
-			alt.value(0.7),
-			alt.value(0.1)
-		)
-	).transform_calculate(
-		# Generate Gaussian jitter with a Box-Muller transform
-		jitter='sqrt(-2*log(random()))*cos(2*PI*random())'
-	).properties(
-		width=700,
-		height=50
-	).add_selection(brush)
-	#.transform_filter(highlight)
-
-
-	# get max and min y
-	maxy = curr_data[h_factor].max().item()
-	miny = curr_data[h_factor].min().item()
-	maxx = curr_data[e_factor].max().item()
-	minx = curr_data[e_factor].min().item()
-	plot = alt.Chart(curr_data).mark_point().encode(
-	    x=alt.X(e_factor, scale=alt.Scale(domain=(minx, maxx))),
-	    y=alt.Y(h_factor,
-	            scale=alt.Scale(domain=(miny, maxy))),
-	    color=alt.Color('Country Name', legend=None),
-	    tooltip=alt.Tooltip(['Country Name', e_factor, h_factor])
-	).transform_filter(brush).properties(width=700).add_selection(highlight)
-	result = alt.vconcat(stripplot, plot)
-
-	st.altair_chart(result, use_container_width=True)
+	# only the years in which some country has both factors
+	years = availability.years([e_factor, h_factor])
+
+	max_year = years[-1].item()
+	# every year in one chart, stepped through in the browser without reruns
+	play = st.sidebar.checkbox("Play Over Time", value=False)
+	year = None if play else st.sidebar.select_slider("Year", options=list(years), value=max_year)
+
+	# the charts of one year, the years next to it on the slider are computed
+	# ahead like in run_popu_dist. Without a year, the charts of every year
+	# behind a slider of their own, on the axes of all the years
+	@memo.memoize(maxsize=256)
+	def year_charts(merge_store, e_factor, h_factor, year):
+		availability = load_availability(merge_store)
+		years = availability.years([e_factor, h_factor])
+		max_year = years[-1].item()
+		if year is None:
+			curr_data = chart_data.chart_data(merge_store.df.take(availability.all_rows([e_factor, h_factor])),
+				['Country Name', 'Year', e_factor, h_factor, 'Life expectancy at birth, total (years)'])
+		else:
+			curr_data = chart_data.chart_data(merge_store.df.take(availability.rows([e_factor, h_factor], year)),
+				['Country Name', e_factor, h_factor, 'Life expectancy at birth, total (years)'])
+		instrument.lap('filter')
+		#st.dataframe(curr_data[['Country Name', e_factor, h_factor]].assign(hack='').set_index('hack'))
+
+		# plot a auxiliary life expectancy graph below
+
+		# get max and min y
+		max_life = curr_data['Life expectancy at birth, total (years)'].max().item()
+		min_life = curr_data['Life expectancy at birth, total (years)'].min().item()
+
+		# get max and min x and y of the scatter plot
+		maxy = curr_data[h_factor].max().item()
+		miny = curr_data[h_factor].min().item()
+		maxx = curr_data[e_factor].max().item()
+		minx = curr_data[e_factor].min().item()
+
+		def build_result(curr_data):
+			# double click to clear brush
+			brush = alt.selection_interval(encodings=['x'])
+			highlight = alt.selection_single(encodings=['color'], on='mouseover', nearest=False, clear="mouseout")
+
+			stripplot = alt.Chart(curr_data).mark_circle(size=40).encode(
+				x=alt.X('Life expectancy at birth, total (years):Q', 
+					scale=alt.Scale(domain=(min_life, max_life))
+				),
+				y=alt.Y('jitter:Q',
+			        title=None,
+			        axis=alt.Axis(values=[0], ticks=False, grid=False, labels=False),
+			        scale=alt.Scale(),
+			    ),
+				color=alt.Color('Country Name', legend=None),
+				opacity=alt.condition(
+					highlight,
+					alt.value(0.7),
+					alt.value(0.1)
+				)
+			).transform_calculate(
+				# Generate Gaussian jitter with a Box-Muller transform
+				jitter='sqrt(-2*log(random()))*cos(2*PI*random())'
+			).properties(
+				width=700,
+				height=50
+			).add_selection(brush)
+			#.transform_filter(highlight)
+
+			plot = alt.Chart(curr_data).mark_point().encode(
+			    x=alt.X(e_factor, scale=alt.Scale(domain=(minx, maxx))),
+			    y=alt.Y(h_factor,
+			            scale=alt.Scale(domain=(miny, maxy))),
+			    color=alt.Color('Country Name', legend=None),
+			    tooltip=alt.Tooltip(['Country Name', e_factor, h_factor])
+			).transform_filter(brush).properties(width=700).add_selection(highlight)
+			if year is None:
+				play_year = alt.selection_single(name='year', fields=['Year'], init={'Year': max_year},
+					bind=alt.binding_range(min=years[0].item(), max=max_year, step=1, name='Year '))
+				stripplot = stripplot.add_selection(play_year).transform_filter(play_year)
+				plot = plot.transform_filter(play_year)
+			result = alt.vconcat(stripplot, plot)
+			return result
+
+		return spec_cache.chart(('per_year', e_factor, h_factor, min_life, max_life, minx, maxx, miny, maxy, year is None), build_result,
+			curr_data=curr_data)
+
+	instrument.altair_chart(year_charts(merge_store, e_factor, h_factor, year), use_container_width=True)
+	if not play:
+		prefetch.around('run_relationship_per_year_all_countries', (e_factor, h_factor), years, year,
+			lambda neighbour: year_charts(merge_store, e_factor, h_factor, neighbour))
 
 	st.markdown('''
 		The above graph consists of two charts. 
@@ -818,8 +1313,18 @@ def run_relationship_per_year_all_countries():
 		already had a selection interval (shown with a gray background), you can hold and drag the selection interval
 		to move it around, the lower chart will reflect the change while you shift the selection interval. Double clicking
 		on the upper chart will reset the selection interval.
+	''')
 
+	st.markdown('''
+		### Strongest Relationships in {}
 
+		The pairs of indicators which went together most closely across countries in that year, strongest first by their
+		Pearson correlation (Spearman's rank correlation is next to it). A lag of 2 compares the economy indicator in that
+		year with the health indicator two years later. Pairs with less than {} countries having data for both are left out.
+	'''.format(max_year if year is None else year, correlation.MIN_PAIRS))
+	strongest_relationships(merge_store, 'countries', max_year if year is None else year)
+
+	st.markdown('''
 		### References
 		[1]
 		Austin B. Frakt (2018) - "How the Economy Affects Health". JAMA. 319(12):1187–1188. doi:10.1001/jama.2018.1739